@@ -0,0 +1,108 @@
+import os
+import json
+from datetime import datetime
+
+from bi_function import BI_CACHE_PATH, get_file_hash
+
+# INGESTION MANIFEST
+# format : {"target_table" : {"file_path" : {"size", "mtime", "content_hash", "target_table", "loaded_at"}}}
+
+MANIFEST_FILE = os.path.join(BI_CACHE_PATH, 'ingestion_manifest.json')
+
+def load_manifest(manifest_file=MANIFEST_FILE):
+    if not os.path.exists(manifest_file):
+        return {}
+
+    try:
+        with open(manifest_file, 'r') as f:
+            return json.load(f)
+    except (OSError, json.JSONDecodeError) as e:
+        print(f"\033[1;31mFailed to read the ingestion manifest, all files will be treated as new: {manifest_file}. Error: {e}\033[0m")
+        return {}
+
+def save_manifest(manifest, manifest_file=MANIFEST_FILE):
+    os.makedirs(os.path.dirname(manifest_file), exist_ok=True)
+
+    # Write to a temporary file first so an interrupted run never leaves a half written manifest
+    temp_file = manifest_file + '.tmp'
+    with open(temp_file, 'w') as f:
+        json.dump(manifest, f, indent=4)
+    os.replace(temp_file, manifest_file)
+
+def get_file_info(path):
+    stat = os.stat(path)
+    return {'size': stat.st_size, 'mtime': stat.st_mtime, 'content_hash': get_file_hash(path)}
+
+def get_changed_files(file_list, target_table, manifest_file=MANIFEST_FILE):
+    """
+    Compare file_list with the files already loaded to target_table.
+
+    The content hash is only computed when the size or mtime differs from the manifest,
+    so unchanged files cost one stat call.
+
+    Returns:
+    changed_files : new or changed files, in the same order as file_list
+    file_info : {path: {'size', 'mtime', 'content_hash'}} for every file that needs a manifest update,
+                including files that were touched but have the same content (not in changed_files)
+    """
+    loaded_files = load_manifest(manifest_file).get(target_table, {})
+
+    changed_files = []
+    file_info = {}
+
+    for path in file_list:
+        stat = os.stat(path)
+        record = loaded_files.get(path)
+
+        if record and record['size'] == stat.st_size and record['mtime'] == stat.st_mtime:
+            continue
+
+        info = {'size': stat.st_size, 'mtime': stat.st_mtime, 'content_hash': get_file_hash(path)}
+        file_info[path] = info
+
+        if record and record.get('content_hash') == info['content_hash']:
+            continue
+
+        changed_files.append(path)
+
+    return changed_files, file_info
+
+def update_manifest(file_info, target_table, reset=False, manifest_file=MANIFEST_FILE):
+    manifest = load_manifest(manifest_file)
+    loaded_files = {} if reset else manifest.get(target_table, {})
+    loaded_at = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+
+    for path, info in file_info.items():
+        loaded_files[path] = {**info, 'target_table': target_table, 'loaded_at': loaded_at}
+
+    manifest[target_table] = loaded_files
+    save_manifest(manifest, manifest_file)
+
+def select_files_to_load(file_list, target_table, write_method):
+    """
+    - write_method = 'append' / 'upsert' : only the new or changed files are returned
+    - write_method = 'replace' : the table is rebuilt, so every file is returned and recorded again
+
+    Returns:
+    (files_to_load, file_info) : pass file_info to record_loaded_files after the upload succeeds
+    """
+    if write_method in ('append', 'upsert'):
+        return get_changed_files(file_list, target_table)
+
+    return list(file_list), {path: get_file_info(path) for path in file_list}
+
+def record_loaded_files(file_info, file_list, df_list, target_table, write_method):
+    """
+    Save the loaded files to the manifest. Files that failed to parse (empty DataFrame without any column)
+    are left out, so they will be picked up again on the next run.
+    """
+    failed_files = {path for path, df in zip(file_list, df_list) if len(df.columns) == 0}
+    loaded_info = {path: info for path, info in file_info.items() if path not in failed_files}
+
+    update_manifest(loaded_info, target_table, reset=(write_method == 'replace'))
+    print(f'Ingestion manifest updated - {target_table} : {len(loaded_info)} files')
+
+# # Example Usage:
+# file_path, file_info = select_files_to_load(file_path, 'report_rc.sp_order_data', 'append')
+# ... parse and upload file_path ...
+# record_loaded_files(file_info, file_path, df_list, 'report_rc.sp_order_data', 'append')
@@ -1,4 +1,4 @@
-from datetime import datetime, timedelta, timezone
+from datetime import date, datetime, timedelta, timezone
 from dateutil.relativedelta import relativedelta
 from gspread_dataframe import set_with_dataframe
 from oauth2client.service_account import ServiceAccountCredentials
@@ -6,14 +6,25 @@ from openpyxl import load_workbook
 from pydrive.auth import GoogleAuth
 from pydrive.drive import GoogleDrive
 from pathlib import Path
+from xml.etree import ElementTree
+from pandas.tseries.api import guess_datetime_format
 
 from google.cloud import bigquery
+from google.api_core.exceptions import GoogleAPICallError, NotFound
 from google.oauth2.service_account import Credentials
 from googleapiclient.discovery import build
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from contextlib import contextmanager
+from pyarrow import csv as pa_csv
 
+import csv
 import glob
 import gspread
+import hashlib
+import json
 import numpy as np
+import pyarrow as pa
+import queue
 import sys,os
 import pandas as pd
 import platform
@@ -23,7 +34,10 @@ import shutil
 import socket
 import subprocess
 import time
+import uuid
 import warnings
+import zipfile
+import zlib
 
 from dotenv import load_dotenv
 load_dotenv()
@@ -50,22 +64,359 @@ BI_PROJECT_ID = os.getenv("GBQ_PROJECT_ID")
 BI_CREDENTIAL = Credentials.from_service_account_info(service_account_bi)
 BI_CLIENT = bigquery.Client.from_service_account_info(service_account_bi)
 
+# LOCAL CACHE PATH
+
+BI_CACHE_PATH = os.getenv("BI_CACHE_PATH") or os.path.join(os.getenv("PROJECT_PATH", ""), "bi_cache")
+
+def evict_cache_dir(cache_path, max_bytes, extension='.parquet'):
+    """
+    Least recently used eviction of the cache files (extension) in cache_path and its sub folders :
+    the oldest files by mtime are removed until the total size is at most max_bytes (a cache hit should refresh the mtime).
+    """
+    cache_files = []
+
+    for root, dirs, files in os.walk(cache_path):
+        for f in files:
+            if f.endswith(extension):
+                try:
+                    stat = os.stat(os.path.join(root, f))
+                    cache_files.append((stat.st_mtime, stat.st_size, os.path.join(root, f)))
+                except OSError:
+                    continue # already removed by another worker
+
+    total_size = sum(size for _, size, _ in cache_files)
+
+    for _, size, cache_file in sorted(cache_files):
+        if total_size <= max_bytes:
+            break
+        try:
+            os.remove(cache_file)
+            total_size -= size
+        except OSError:
+            continue
+
 # FUNCTION READ GBQ
+# Query results are downloaded with the BigQuery Storage Read API (parallel Arrow streams over gRPC) when
+# google-cloud-bigquery-storage is installed, otherwise, or when the Storage Read API fails, page by page with the REST API.
+
+try:
+    from google.cloud import bigquery_storage
+except ImportError:
+    bigquery_storage = None
+
+BQ_STORAGE_CLIENT = {} # one Storage Read API client per process, created on the first read
+
+def get_bqstorage_client():
+    if bigquery_storage is None:
+        return None
+
+    if 'client' not in BQ_STORAGE_CLIENT:
+        try:
+            BQ_STORAGE_CLIENT['client'] = bigquery_storage.BigQueryReadClient(credentials=BI_CREDENTIAL)
+        except Exception as e:
+            print(f"\033[1;31mFailed to create the BigQuery Storage client, the query results are downloaded with the REST API. Error: {e}\033[0m")
+            BQ_STORAGE_CLIENT['client'] = None
+
+    return BQ_STORAGE_CLIENT['client']
+
+# QUERY PARAMETERS
+# Values are bound as named query parameters (@name in the SQL) instead of being formatted into the SQL text,
+# so the same query text is sent for every store / month and the BigQuery result cache can be used.
+# list / tuple values are bound as ARRAY parameters, to be used with IN UNNEST(@name)
+
+BQ_PARAMETER_TYPES = [(bool, 'BOOL'), (int, 'INT64'), (float, 'FLOAT64'), (datetime, 'TIMESTAMP'), (date, 'DATE'), (str, 'STRING')] # checked in order, bool is an int and datetime is a date
+
+def get_bq_parameter_type(value):
+    return next((bq_type for python_type, bq_type in BQ_PARAMETER_TYPES if isinstance(value, python_type)), 'STRING')
+
+def get_query_parameters(params):
+    query_parameters = []
+    for name, value in params.items():
+        if isinstance(value, (list, tuple)):
+            query_parameters.append(bigquery.ArrayQueryParameter(name, get_bq_parameter_type(value[0]) if value else 'STRING', list(value)))
+        else:
+            query_parameters.append(bigquery.ScalarQueryParameter(name, get_bq_parameter_type(value), value))
+    return query_parameters
+
+def get_query_job_config(params=None, **kwargs):
+    return bigquery.QueryJobConfig(query_parameters=get_query_parameters(params or {}), **kwargs)
+
+def get_select_list(columns, table_alias=None):
+    # Column list for SELECT / SELECT * EXCEPT, BigQuery only bills the bytes of the selected columns
+    prefix = f'{table_alias}.' if table_alias else ''
+    return ', '.join(f'{prefix}`{col}`' for col in columns)
+
+def read_from_gbq(client, sql, read_mode='default', params=None):
+    """
+    Parameters:
+    params : optional, {name : value} bound to @name in sql, for example {'folder_id': folder_id, 'month_list': ['202411', '202412']}
+    read_mode :
+    - default : numpy / object dtypes, same as client.query(sql).to_dataframe()
+    - arrow : Arrow-backed dtypes (pd.ArrowDtype), the columns stay in Arrow memory instead of Python objects,
+              for wide or long results that are only filtered, aggregated or written again
+    """
+    rows = client.query(sql, job_config=get_query_job_config(params)).result()
+    bqstorage_client = get_bqstorage_client() if client is BI_CLIENT else None
+    create_bqstorage_client = client is not BI_CLIENT # other clients : the library creates a Storage client with their credentials
+
+    try:
+        if read_mode == 'arrow':
+            return rows.to_arrow(bqstorage_client=bqstorage_client, create_bqstorage_client=create_bqstorage_client).to_pandas(types_mapper=pd.ArrowDtype)
+        return rows.to_dataframe(bqstorage_client=bqstorage_client, create_bqstorage_client=create_bqstorage_client)
+
+    except GoogleAPICallError as e:
+        # For example the service account does not have the bigquery.readsessions.create permission
+        print(f"\033[1;31m--Failed to read with the BigQuery Storage API, reading with the REST API instead. Error: {e}\033[0m")
+        rows = client.query(sql, job_config=get_query_job_config(params)).result() # the result of the same query is served from the BigQuery cache
+
+        if read_mode == 'arrow':
+            return rows.to_arrow(create_bqstorage_client=False).to_pandas(types_mapper=pd.ArrowDtype)
+        return rows.to_dataframe(create_bqstorage_client=False)
+
+# TABLE SCHEMA REGISTRY
+# Table schemas are read with a metadata call (client.get_table, no query job) and kept in-process and on disk.
+# The tables that are created or replaced by write_to_gbq / ensure_partitioned_table can get a new schema, so their entry is dropped,
+# and the disk entries are read again after TABLE_SCHEMA_TTL_HOURS for schema changes made outside of this repo.
+# format : {"project.dataset.table" : {"cached_at", "fields" : [SchemaField api representation, ...]}}
+
+TABLE_SCHEMA_FILE = os.path.join(BI_CACHE_PATH, 'table_schema.json')
+TABLE_SCHEMA_TTL_HOURS = float(os.getenv("BI_TABLE_SCHEMA_TTL_HOURS", 24))
+TABLE_SCHEMA = {} # in-process registry, same format as the file
+
+def load_table_schema_file(schema_file=TABLE_SCHEMA_FILE):
+    if not os.path.exists(schema_file):
+        return {}
+
+    try:
+        with open(schema_file, 'r') as f:
+            return json.load(f)
+    except (OSError, json.JSONDecodeError) as e:
+        print(f"\033[1;31mFailed to read the table schema registry, the schemas will be fetched again: {schema_file}. Error: {e}\033[0m")
+        return {}
+
+def save_table_schema_file(registry, schema_file=TABLE_SCHEMA_FILE):
+    os.makedirs(os.path.dirname(schema_file), exist_ok=True)
+
+    # Write to a temporary file first so parallel runs never read a half written registry
+    temp_file = f'{schema_file}.{os.getpid()}.tmp'
+    with open(temp_file, 'w') as f:
+        json.dump(registry, f)
+    os.replace(temp_file, schema_file)
+
+def get_table_schema(table_id, refresh=False):
+    """
+    Return the list of bigquery.SchemaField of the table, from the registry when it is known.
+
+    Parameters:
+    table_id : project.dataset.table
+    refresh : fetch the schema again with client.get_table
+    """
+    entry = None if refresh else TABLE_SCHEMA.get(table_id)
 
-def read_from_gbq(client, sql):
-    return client.query(sql).to_dataframe()
+    if entry is None and not refresh:
+        entry = load_table_schema_file().get(table_id)
+        if entry is not None and time.time() - entry['cached_at'] > TABLE_SCHEMA_TTL_HOURS * 3600:
+            entry = None
+
+    if entry is None:
+        table = BI_CLIENT.get_table(table_id)
+        entry = {'cached_at': time.time(), 'fields': [field.to_api_repr() for field in table.schema]}
+
+        registry = load_table_schema_file()
+        registry[table_id] = entry
+        save_table_schema_file(registry)
+
+    TABLE_SCHEMA[table_id] = entry
+    return [bigquery.SchemaField.from_api_repr(field) for field in entry['fields']]
+
+def get_table_columns(table_id, refresh=False):
+    return [field.name for field in get_table_schema(table_id, refresh)]
+
+def invalidate_table_schema(table_id):
+    TABLE_SCHEMA.pop(table_id, None)
+
+    registry = load_table_schema_file()
+    if registry.pop(table_id, None) is not None:
+        save_table_schema_file(registry)
+
+# # Example Usage:
+# column_list = get_table_columns(f'{BI_PROJECT_ID}.report_rc.rpt_sp_journal_base')
+# df = df[column_list]
 
 # FUNCTION WRITE GBQ
 
-def write_to_gbq(df, project_id, credential, target_table, import_method, job_location):
-    df.to_gbq(target_table, project_id=project_id, if_exists=import_method, location=job_location, progress_bar=False,
-              credentials=credential)
+# BigQuery type of each pandas dtype kind, same as to_gbq (naive datetime columns are loaded as TIMESTAMP)
+# timedelta ('m') has no BigQuery type, write_to_gbq refuses these columns
+BQ_TYPE_MAPPING = {'i': 'INTEGER', 'u': 'INTEGER', 'b': 'BOOLEAN', 'f': 'FLOAT', 'M': 'TIMESTAMP', 'O': 'STRING', 'S': 'STRING', 'U': 'STRING'}
+
+def get_bq_schema(df, client=None, table_id=None):
+    """
+    Return the explicit load job schema of df. When the table exists, the field types of the existing columns are used,
+    so appended data always matches the table.
+    """
+    existing_fields = {}
+    if client is not None and table_id is not None:
+        try:
+            existing_fields = {field.name: field for field in client.get_table(table_id).schema}
+        except NotFound:
+            pass
+
+    return [existing_fields.get(col) or bigquery.SchemaField(col, BQ_TYPE_MAPPING.get(dtype.kind, 'STRING'))
+            for col, dtype in df.dtypes.items()]
+
+def write_to_gbq(df, project_id, credential, target_table, import_method, job_location, schema=None, schema_update_options=None):
+    """
+    Load df to BigQuery with a native load job : the DataFrame is converted to Arrow and sent as compressed Parquet,
+    with an explicit schema instead of a schema inferred on every call.
+
+    Parameters:
+    target_table : dataset.table, or dataset.table$YYYYMM to load a single partition
+    import_method : replace / append
+    schema : optional list of bigquery.SchemaField, by default built with get_bq_schema
+    schema_update_options : optional list of bigquery.SchemaUpdateOption, for example to add the new columns of df when loading a partition
+    """
+    # A duration is not a time of day, convert it before the upload (for example to seconds with .dt.total_seconds())
+    timedelta_columns = df.select_dtypes('timedelta').columns.tolist()
+    if timedelta_columns:
+        raise ValueError(f'Timedelta columns can not be loaded to BigQuery, convert them first : {target_table} {timedelta_columns}')
+
+    # Categorical columns (store dimension) are uploaded as plain strings
+    category_columns = df.select_dtypes('category').columns
+    if len(category_columns) > 0:
+        df = df.astype({col: object for col in category_columns})
+
+    client = BI_CLIENT if project_id == BI_PROJECT_ID else bigquery.Client(project=project_id, credentials=credential)
+    table_id = f'{project_id}.{target_table}'
+
+    job_config = bigquery.LoadJobConfig(
+        schema=schema or get_bq_schema(df, client, table_id if import_method == 'append' else None),
+        source_format=bigquery.SourceFormat.PARQUET,
+        write_disposition=bigquery.WriteDisposition.WRITE_TRUNCATE if import_method == 'replace' else bigquery.WriteDisposition.WRITE_APPEND,
+        schema_update_options=schema_update_options,
+    )
+
+    try:
+        load_job = client.load_table_from_dataframe(df, table_id, job_config=job_config, location=job_location, parquet_compression='snappy')
+    except (pa.ArrowInvalid, pa.ArrowTypeError) as e:
+        # Object columns with mixed value types can not be converted to Arrow, use the slower to_gbq upload for them
+        print(f'\033[1;31m--Failed to convert the data to Arrow, uploading with to_gbq instead : {target_table}. Error: {str(e)}\033[0m')
+        df.to_gbq(target_table, project_id=project_id, if_exists=import_method, location=job_location, progress_bar=False,
+                  credentials=credential)
+    else:
+        load_job.result()  # Wait for the job to complete
+
+    # A replaced table can have new columns, a replaced partition ($YYYYMM) keeps the table schema
+    if import_method == 'replace' and '$' not in target_table:
+        invalidate_table_schema(table_id)
+
+# STAGING TABLE
+# Every write gets its own stage table in data_stage : <target>_<suffix>_<run id>_<random>, so loaders and journal tasks
+# can write to the same target at the same time without overwriting each other's stage data.
+# The stage table is dropped at the end of the write, and expires after STAGE_TABLE_EXPIRATION_HOURS when the run is killed :
+# the expiration is set on the table when write_stage_table creates it, before any data is loaded.
+
+STAGE_DATASET = 'data_stage'
+STAGE_TABLE_EXPIRATION_HOURS = 6
+BI_RUN_ID = f"{datetime.now().strftime('%Y%m%d%H%M%S')}_{os.getpid()}"
+
+def get_stage_table_name(target_table, suffix=None):
+    name = '_'.join(part for part in [target_table.replace('.', '_'), suffix, BI_RUN_ID, uuid.uuid4().hex[:8]] if part)
+    return f'{STAGE_DATASET}.{name}'
+
+def write_stage_table(df, stage_table, import_method='replace'):
+    """
+    Load df to the stage table. With import_method = 'replace', the stage table is created first with its expiration time
+    (the stage table names are unique, see get_stage_table_name), then df is appended to it,
+    so the table expires even when the run is killed during the load.
+    """
+    if import_method == 'replace':
+        table = bigquery.Table(f'{BI_PROJECT_ID}.{stage_table}', schema=get_bq_schema(df))
+        table.expires = datetime.now(timezone.utc) + timedelta(hours=STAGE_TABLE_EXPIRATION_HOURS)
+        BI_CLIENT.create_table(table)
+
+    write_to_gbq(df, BI_PROJECT_ID, BI_CREDENTIAL, stage_table, 'append', 'asia-southeast2')
+
+@contextmanager
+def stage_table_scope(target_table, suffix=None):
+    """
+    Yield a unique stage table name (dataset.table) for one write, the table is dropped when the block exits.
+
+    Parameters:
+    target_table : table written with the stage table, used as the prefix of the name
+    suffix : optional, to tell apart the stage tables of the same target, for example 'upsert'
+    """
+    stage_table = get_stage_table_name(target_table, suffix)
+    try:
+        yield stage_table
+    finally:
+        try:
+            BI_CLIENT.delete_table(f'{BI_PROJECT_ID}.{stage_table}', not_found_ok=True)
+        except Exception as e:
+            print(f"\033[1;31mFailed to drop the stage table, it expires in {STAGE_TABLE_EXPIRATION_HOURS} hours : {stage_table}. Error: {e}\033[0m")
+
+# # Example Usage:
+# with stage_table_scope('report_rc.sp_order_data', 'upsert') as stage_table:
+#     write_stage_table(df, stage_table)
+#     BI_CLIENT.query(f'... FROM `{stage_table}` ...').result()
+
+def get_unique_id_conditions(unique_col_ref, date_col_ref=None):
+    # Join condition between the target table and the stage table used by the DELETE statement
+    conditions = [f"UPPER(target.{col}) = UPPER(temp.{col})" for col in unique_col_ref]
+    if date_col_ref:
+        conditions.append(f"DATE(target.{date_col_ref}) = DATE(temp.{date_col_ref})")
+    return " AND ".join(conditions)
+
+def add_merge_keys(df, unique_col_ref, date_col_ref=None):
+    # Normalized key columns (_key_*) loaded with the stage table, so the MERGE does not run UPPER() on the stage side
+    merge_keys = {f'_key_{col}': df[col].str.upper() for col in unique_col_ref}
+    if date_col_ref:
+        merge_keys['_key_date'] = pd.to_datetime(df[date_col_ref]).dt.normalize()
+    return df.assign(**merge_keys)
+
+def merge_stage_table(stage_table, target_table, columns, unique_col_ref, date_col_ref=None):
+    """
+    Apply the stage table (loaded with add_merge_keys) to the target table in one atomic MERGE :
+    the target rows with the same unique_col_ref (and date of date_col_ref) are deleted and the stage rows are inserted.
+    """
+    key_columns = [f'_key_{col}' for col in unique_col_ref] + (['_key_date'] if date_col_ref else [])
+    conditions = [f"UPPER(target.{col}) = temp._key_{col}" for col in unique_col_ref]
+    if date_col_ref:
+        conditions.append(f"DATE(target.{date_col_ref}) = DATE(temp._key_date)")
+
+    column_list = ', '.join(f'`{col}`' for col in columns)
+    key_list = ', '.join(key_columns)
+
+    # Source rows : the stage rows to insert + one row per distinct key to delete the matching target rows
+    merge_sql = f'''
+        MERGE `{BI_PROJECT_ID}.{target_table}` AS target
+        USING (
+            SELECT {column_list}, {key_list}, FALSE AS _is_delete FROM `{stage_table}`
+            UNION ALL
+            SELECT {', '.join(f'NULL AS `{col}`' for col in columns)}, {key_list}, TRUE AS _is_delete
+            FROM (SELECT DISTINCT {key_list} FROM `{stage_table}`)
+        ) AS temp
+        ON temp._is_delete AND {" AND ".join(conditions)}
+        WHEN MATCHED THEN
+            DELETE
+        WHEN NOT MATCHED AND NOT temp._is_delete THEN
+            INSERT ({column_list}) VALUES ({', '.join(f'temp.`{col}`' for col in columns)});
+    '''
+
+    try:
+        query_job = BI_CLIENT.query(merge_sql)
+        query_job.result()  # Wait for the job to complete
+        print(f"Total rows merged (deleted + inserted): {query_job.num_dml_affected_rows}")
+        print(f"Data uploaded - {target_table} : {datetime.now().strftime('%Y-%m-%d %H:%M')}")
+
+    except Exception as e:
+        print(f"\033[1;31mError during merge process: {e}\033[0m")
+        raise
 
 def write_table_by_unique_id(df, target_table, write_method, unique_col_ref, date_col_ref=None):
 
     """
     Parameters:
-    write_method: replace / append
+    write_method: replace / append / upsert (same result as append, in one atomic MERGE without the delete and load window)
     unique_col_ref : must be a list contains the column name where the data type is string, even if it's only have one value. for example : ['store_id']
     date_col_ref : must be a single variable, 1 column name with date data type. for example : 'order_creation_time'
     """
@@ -90,49 +441,181 @@ def write_table_by_unique_id(df, target_table, write_method, unique_col_ref, dat
             df_temp = df_temp[unique_col_ref + [date_col_ref]].drop_duplicates()
 
             df_temp[date_col_ref] = pd.to_datetime(df_temp[date_col_ref])
-            
-            conditions = " AND ".join(
-                [f"UPPER(target.{col}) = UPPER(temp.{col})" for col in unique_col_ref] + 
-                [f"DATE(target.{date_col_ref}) = DATE(temp.{date_col_ref})"]
-            )
         else:
             df_temp = df_temp[unique_col_ref].drop_duplicates()
 
-            conditions = " AND ".join(
-                [f"UPPER(target.{col}) = UPPER(temp.{col})" for col in unique_col_ref]
-            )
+        conditions = get_unique_id_conditions(unique_col_ref, date_col_ref)
 
         # Load Temporary Table
-        stage_table = f'data_stage.{target_table.replace('.', '_')}'
-        write_to_gbq(df_temp, BI_PROJECT_ID, BI_CREDENTIAL, stage_table, 'replace', 'asia-southeast2')
+        with stage_table_scope(target_table) as stage_table:
+            write_stage_table(df_temp, stage_table)
+            time.sleep(2)
+
+            # Delete Origin Table
+            delete_sql = f'''
+                DELETE FROM `{BI_PROJECT_ID}.{target_table}` AS target
+                WHERE EXISTS (
+                    SELECT 1 FROM `{stage_table}` AS temp
+                    WHERE {conditions}
+                );
+            '''
+
+            try:
+                query_job = BI_CLIENT.query(delete_sql)
+                query_job.result()  # Wait for the job to complete
+
+                print(f"Total rows deleted: {query_job.num_dml_affected_rows}")
+                print(f'Total rows to upload: {len(df)}')
+                
+                # Upload data to BigQuery
+                write_to_gbq(df, BI_PROJECT_ID, BI_CREDENTIAL, target_table, 'append', 'asia-southeast2')
+                print(f"Data uploaded - {target_table} : {datetime.now().strftime('%Y-%m-%d %H:%M')}")
+
+            except Exception as e:
+                print(f"\033[1;31mError during delete and load process: {e}\033[0m")
+                raise
+
+    elif write_method == 'upsert':
+        print(f'write_method = {write_method}')
+        print(f'Total rows to upload: {len(df)}')
+
+        # Load the full payload to the stage table once, then MERGE
+        with stage_table_scope(target_table, 'upsert') as stage_table:
+            write_stage_table(add_merge_keys(df, unique_col_ref, date_col_ref), stage_table)
+
+            merge_stage_table(stage_table, target_table, list(df.columns), unique_col_ref, date_col_ref)
+
+    else:
+        print(f'\033[1;31mThe options for the write_table method are "replace", "append" or "upsert". Please choose the correct one.\033[0m')
+
+def write_table_by_unique_id_batched(df_batches, target_table, write_method, unique_col_ref, date_col_ref=None):
+
+    """
+    Same result as write_table_by_unique_id(pd.concat(df_batches)), but only one batch is kept in memory.
+
+    - write_method = 'replace' : every batch is appended to a stage table first, then the target table is replaced
+                                 with the stage table in one query, so a failed batch leaves the target table untouched
+    - write_method = 'append' : every batch is appended to a stage table first, then the rows of the target table
+                                with the same unique_col_ref (and date of date_col_ref) are deleted and the stage table
+                                is inserted, so rows from different batches never delete each other
+    - write_method = 'upsert' : same as append, the stage table is applied with one MERGE (see merge_stage_table)
+
+    Parameters:
+    df_batches : iterable of DataFrame with the same columns, for example read_files_in_batches(...)
+    other parameters : same as write_table_by_unique_id
+    """
+
+    if write_method not in ('replace', 'append', 'upsert'):
+        print(f'\033[1;31mThe options for the write_table method are "replace", "append" or "upsert". Please choose the correct one.\033[0m')
+        return
+
+    print(f'write_method = {write_method}')
+
+    with stage_table_scope(target_table, 'batch') as stage_table:
+        columns = None
+        total_rows = 0
+
+        for df in df_batches:
+            columns = columns or list(df.columns)
+
+            if write_method == 'upsert':
+                df = add_merge_keys(df, unique_col_ref, date_col_ref)
+
+            write_stage_table(df, stage_table, 'replace' if total_rows == 0 else 'append')
+
+            total_rows += len(df)
+            print(f'Batch uploaded - {stage_table} : {len(df)} rows')
+
+        if columns is None:
+            print(f'No data to upload - {target_table}')
+            return
+
+        column_list = ', '.join(f'`{col}`' for col in columns)
+
+        if write_method == 'replace':
+            # The query result replaces the data and the schema of the target table in one job,
+            # the target keeps its own table options (no expiration from the stage table)
+            replace_config = bigquery.QueryJobConfig(destination=f'{BI_PROJECT_ID}.{target_table}',
+                                                     write_disposition=bigquery.WriteDisposition.WRITE_TRUNCATE)
+            try:
+                BI_CLIENT.query(f'SELECT {column_list} FROM `{stage_table}`', job_config=replace_config).result()
+            except Exception as e:
+                print(f"\033[1;31mError during replace process, {target_table} is unchanged: {e}\033[0m")
+                raise
+
+            invalidate_table_schema(f'{BI_PROJECT_ID}.{target_table}')
+            print(f"Data uploaded - {target_table} : {total_rows} rows, {datetime.now().strftime('%Y-%m-%d %H:%M')}")
+            return
+
+        if write_method == 'upsert':
+            merge_stage_table(stage_table, target_table, columns, unique_col_ref, date_col_ref)
+            return
+
         time.sleep(2)
 
-        # Delete Origin Table
+        # Delete Origin Table, then Insert the Stage Table
         delete_sql = f'''
             DELETE FROM `{BI_PROJECT_ID}.{target_table}` AS target
             WHERE EXISTS (
                 SELECT 1 FROM `{stage_table}` AS temp
-                WHERE {conditions}
+                WHERE {get_unique_id_conditions(unique_col_ref, date_col_ref)}
             );
         '''
 
+        insert_sql = f'''
+            INSERT INTO `{BI_PROJECT_ID}.{target_table}` ({column_list})
+            SELECT {column_list} FROM `{stage_table}`;
+        '''
+
         try:
             query_job = BI_CLIENT.query(delete_sql)
             query_job.result()  # Wait for the job to complete
-
             print(f"Total rows deleted: {query_job.num_dml_affected_rows}")
-            print(f'Total rows to upload: {len(df)}')
-            
-            # Upload data to BigQuery
-            write_to_gbq(df, BI_PROJECT_ID, BI_CREDENTIAL, target_table, 'append', 'asia-southeast2')
-            print(f"Data uploaded - {target_table} : {datetime.now().strftime('%Y-%m-%d %H:%M')}")
+
+            query_job = BI_CLIENT.query(insert_sql)
+            query_job.result()
+            print(f"Data uploaded - {target_table} : {query_job.num_dml_affected_rows} rows, {datetime.now().strftime('%Y-%m-%d %H:%M')}")
 
         except Exception as e:
             print(f"\033[1;31mError during delete and load process: {e}\033[0m")
             raise
 
-    else:
-        print(f'\033[1;31mThe options for the write_table method are either "replace" or "append". Please choose the correct one.\033[0m')
+def delete_table_by_unique_id(df, target_table, unique_col_ref, date_col_ref=None):
+
+    """
+    Delete the rows of the target table with the same unique_col_ref (and date of date_col_ref) as the rows of df,
+    same matching as write_table_by_unique_id(write_method='append').
+
+    Parameters:
+    df : DataFrame with the unique_col_ref (and date_col_ref) columns
+    """
+
+    key_columns = unique_col_ref + ([date_col_ref] if date_col_ref else [])
+    df_temp = df[key_columns].drop_duplicates()
+
+    if len(df_temp) == 0:
+        return
+
+    with stage_table_scope(target_table, 'delete') as stage_table:
+        write_stage_table(df_temp, stage_table)
+        time.sleep(2)
+
+        delete_sql = f'''
+            DELETE FROM `{BI_PROJECT_ID}.{target_table}` AS target
+            WHERE EXISTS (
+                SELECT 1 FROM `{stage_table}` AS temp
+                WHERE {get_unique_id_conditions(unique_col_ref, date_col_ref)}
+            );
+        '''
+
+        try:
+            query_job = BI_CLIENT.query(delete_sql)
+            query_job.result()  # Wait for the job to complete
+            print(f"Total rows deleted: {query_job.num_dml_affected_rows}")
+
+        except Exception as e:
+            print(f"\033[1;31mError during delete process: {e}\033[0m")
+            raise
 
 # # Example Usage:
 # write_table_by_unique_id(df,
@@ -142,6 +625,234 @@ def write_table_by_unique_id(df, target_table, write_method, unique_col_ref, dat
 #                         date_col_ref = 'order_creation_time'
 #                         )
 
+# PARTITIONED REPORT TABLE
+# Report tables keyed on a month column (YYYYMM) and a store column are partitioned by month on ingestion time :
+# the rows are loaded in the partition of their month (table$YYYYMM), so the table schema does not get an extra column.
+# Filter on _PARTITIONTIME = TIMESTAMP('YYYY-MM-01') (or a TIMESTAMP query parameter) to read or delete only one month.
+# A table created before the partitioning is migrated once with migrate_to_partitioned_table, on the first write by
+# ensure_partitioned_table, or before a job that reads it with _PARTITIONTIME filters (see report_sp_journal.py).
+
+PARTITION_KEY_SEPARATOR = '\x1f' # joins the cluster_col_ref values of a row into one key
+
+def get_partition_month(month):
+    return f"{month}", datetime(int(month[:4]), int(month[4:6]), 1) # (partition decorator, _PARTITIONTIME value)
+
+def get_partition_key_condition(cluster_col_ref):
+    # @keys_<n> : distinct values of every column, for the cluster pruning
+    # @keys : the values of every row joined with PARTITION_KEY_SEPARATOR, so only the exact combinations are matched
+    conditions = [f'`{col}` IN UNNEST(@keys_{i})' for i, col in enumerate(cluster_col_ref)]
+    if len(cluster_col_ref) > 1:
+        key_columns = ', '.join(f'CAST(`{col}` AS STRING)' for col in cluster_col_ref)
+        conditions.append(f"ARRAY_TO_STRING([{key_columns}], '\\x1f') IN UNNEST(@keys)")
+    return '(' + ' AND '.join(conditions) + ')'
+
+def create_partitioned_table(table_id, schema, month_col_ref, cluster_col_ref):
+    table = bigquery.Table(table_id, schema=schema)
+    table.time_partitioning = bigquery.TimePartitioning(type_=bigquery.TimePartitioningType.MONTH)
+    table.clustering_fields = [month_col_ref] + cluster_col_ref
+    return BI_CLIENT.create_table(table)
+
+def ensure_partitioned_table(df, target_table, month_col_ref, cluster_col_ref):
+    """
+    Create the month partitioned table when it does not exist yet. Returns the table schema.
+    An existing table without partition is migrated first, see migrate_to_partitioned_table.
+    """
+    table_id = f'{BI_PROJECT_ID}.{target_table}'
+
+    try:
+        table = BI_CLIENT.get_table(table_id)
+    except NotFound:
+        table = create_partitioned_table(table_id, get_bq_schema(df), month_col_ref, cluster_col_ref)
+        invalidate_table_schema(table_id)
+        print(f'Partitioned table created - {target_table}')
+
+    if table.time_partitioning is None:
+        print(f'{target_table} is not partitioned, migrating it before the first write by partition')
+        migrate_to_partitioned_table(target_table, month_col_ref, cluster_col_ref)
+        table = BI_CLIENT.get_table(table_id)
+
+    return table.schema
+
+def migrate_to_partitioned_table(target_table, month_col_ref='report_month', cluster_col_ref=['folder_id']):
+    """
+    One-off migration of an existing table without partition to a month partitioned table,
+    nothing is done when the table is already partitioned or does not exist yet.
+
+    The rows are copied to <table>_partitioned (one INSERT statement, every row goes to the partition of its month_col_ref),
+    and the tables are only swapped after the copy has the same row count : the original table is renamed to
+    <table>_unpartitioned and kept, drop it once the new table is checked.
+    Ingestion-time partitions can not be created with CREATE TABLE ... AS SELECT, so the table is created first.
+    """
+    table_id = f'{BI_PROJECT_ID}.{target_table}'
+    try:
+        table = BI_CLIENT.get_table(table_id)
+    except NotFound:
+        print(f'Nothing to migrate, the partitioned table is created on the first write - {target_table}')
+        return
+
+    if table.time_partitioning is not None:
+        print(f'Already partitioned - {target_table}')
+        return
+
+    # Rows without a valid month have no partition, they are fixed first instead of being dropped
+    invalid_month = read_from_gbq(BI_CLIENT, f"SELECT COUNT(1) FROM `{table_id}` WHERE SAFE.PARSE_DATE('%Y%m', {month_col_ref}) IS NULL").iloc[0, 0]
+    if invalid_month > 0:
+        print(f'\033[1;31m{target_table} has {invalid_month} rows with a null or invalid {month_col_ref}, fix them before the migration.\033[0m')
+        raise ValueError(f'{target_table} can not be migrated to a partitioned table : {invalid_month} rows with a null or invalid {month_col_ref}')
+
+    # A copy left by a migration that was killed is incomplete, it is created again
+    BI_CLIENT.delete_table(f'{table_id}_partitioned', not_found_ok=True)
+    new_table = create_partitioned_table(f'{table_id}_partitioned', table.schema, month_col_ref, cluster_col_ref)
+    new_table_id = f'{new_table.project}.{new_table.dataset_id}.{new_table.table_id}'
+
+    column_list = get_select_list(field.name for field in table.schema)
+    try:
+        query_job = BI_CLIENT.query(f'''
+            INSERT INTO `{new_table_id}` (_PARTITIONTIME, {column_list})
+            SELECT TIMESTAMP(PARSE_DATE('%Y%m', {month_col_ref})), {column_list} FROM `{table_id}`
+        ''')
+        query_job.result()
+
+        if query_job.num_dml_affected_rows != table.num_rows:
+            raise ValueError(f'{query_job.num_dml_affected_rows} rows copied instead of {table.num_rows}')
+    except Exception as e:
+        print(f'\033[1;31mMigration failed, {target_table} is not changed : {e}\033[0m')
+        BI_CLIENT.delete_table(new_table_id, not_found_ok=True)
+        raise
+
+    # Swap, the original table is only renamed, so nothing is lost when the second rename fails
+    BI_CLIENT.query(f'ALTER TABLE `{table_id}` RENAME TO `{table.table_id}_unpartitioned`').result()
+    BI_CLIENT.query(f'ALTER TABLE `{new_table_id}` RENAME TO `{table.table_id}`').result()
+    invalidate_table_schema(table_id)
+
+    print(f'Migrated to month partitioned table - {target_table}, the original table is kept as {target_table}_unpartitioned')
+
+# # Example Usage:
+# migrate_to_partitioned_table('report_rc.rpt_sp_journal_base', month_col_ref='report_month', cluster_col_ref=['folder_id'])
+
+def write_table_by_partition(df, target_table, write_method, month_col_ref='report_month', cluster_col_ref=['folder_id']):
+
+    """
+    Write a report table keyed on month_col_ref + cluster_col_ref, only touching the month partitions in df
+    (instead of the stage table + DELETE cycle of write_table_by_unique_id that scans the whole table).
+
+    Parameters:
+    write_method :
+    - replace : the table gets the content of df : every month partition of df is replaced by a truncate-and-load
+                of the partition, then the partitions of the other months are deleted
+    - append : in every month partition of df, the rows with the same cluster_col_ref values are deleted
+               (the DELETE only scans this partition), then df is loaded in the partition
+    - overwrite : every month partition of df is replaced by a truncate-and-load of the partition,
+                  to be used when df has the full month (for example every store)
+    month_col_ref : month column with format YYYYMM (string), used as partition
+    cluster_col_ref : list of key columns used with month_col_ref, for example ['folder_id']
+    """
+
+    if write_method not in ('replace', 'append', 'overwrite'):
+        print(f'\033[1;31mThe options for the write_table_by_partition method are "replace", "append" or "overwrite". Please choose the correct one.\033[0m')
+        return
+
+    print(f'write_method = {write_method}')
+
+    schema = ensure_partitioned_table(df, target_table, month_col_ref, cluster_col_ref)
+    schema = [field for field in schema if field.name in df.columns]
+    schema_update_options = None
+
+    # Every partition is swapped by its own load job, so a failed load leaves the previous data of the month in place
+    if write_method == 'replace':
+        schema = get_bq_schema(df, BI_CLIENT, f'{BI_PROJECT_ID}.{target_table}')
+        schema_update_options = [bigquery.SchemaUpdateOption.ALLOW_FIELD_ADDITION] # new columns of df are added to the table
+
+    # Same query text for every month and batch, the values are bound as query parameters
+    delete_sql = f'''
+        DELETE FROM `{BI_PROJECT_ID}.{target_table}`
+        WHERE _PARTITIONTIME = @partition_time
+        AND {get_partition_key_condition(cluster_col_ref)};
+    '''
+
+    for month, df_month in df.groupby(month_col_ref, sort=True, observed=True):
+        partition, partition_time = get_partition_month(str(month))
+
+        if write_method == 'append':
+            keys = df_month[cluster_col_ref].drop_duplicates().astype(str)
+            params = {'partition_time': partition_time, **{f'keys_{i}': keys[col].unique().tolist() for i, col in enumerate(cluster_col_ref)}}
+            if len(cluster_col_ref) > 1:
+                params['keys'] = keys.agg(PARTITION_KEY_SEPARATOR.join, axis=1).tolist()
+
+            try:
+                query_job = BI_CLIENT.query(delete_sql, job_config=get_query_job_config(params))
+                query_job.result()  # Wait for the job to complete
+                print(f"Total rows deleted: {query_job.num_dml_affected_rows}")
+            except Exception as e:
+                print(f"\033[1;31mError during delete process: {e}\033[0m")
+                raise
+
+        write_to_gbq(df_month, BI_PROJECT_ID, BI_CREDENTIAL, f'{target_table}${partition}',
+                     'append' if write_method == 'append' else 'replace', 'asia-southeast2', schema=schema,
+                     schema_update_options=schema_update_options)
+        print(f"Data uploaded - {target_table}${partition} : {len(df_month)} rows, {datetime.now().strftime('%Y-%m-%d %H:%M')}")
+
+    if write_method == 'replace' and len(df) > 0:
+        # Only after every month of df is loaded : the months that are not in df anymore
+        partition_times = [get_partition_month(str(month))[1] for month in df[month_col_ref].dropna().unique()]
+        query_job = BI_CLIENT.query(f'''
+            DELETE FROM `{BI_PROJECT_ID}.{target_table}`
+            WHERE _PARTITIONTIME NOT IN UNNEST(@partition_times)
+        ''', job_config=get_query_job_config({'partition_times': partition_times}))
+        query_job.result()
+        print(f"Total rows deleted from the other months: {query_job.num_dml_affected_rows}")
+        invalidate_table_schema(f'{BI_PROJECT_ID}.{target_table}')
+
+# WRITE BUFFER
+# Frames written to the same target table by many small tasks (for example one journal task per store per month)
+# are collected and written with one call on flush, instead of one stage upload / DELETE / load per task.
+# Flush before a task reads the buffered table, the buffered rows are not in BigQuery yet.
+# format : {(write_function, target_table, write arguments) : [df, ...]}
+
+WRITE_BUFFER = {}
+WRITE_BUFFER_MAX_ROWS = int(os.getenv("BI_WRITE_BUFFER_MAX_ROWS", 1000000))
+
+def get_write_buffer_key(write_function, target_table, kwargs):
+    return (write_function, target_table, tuple(sorted((k, tuple(v) if isinstance(v, list) else v) for k, v in kwargs.items())))
+
+def write_buffer_entry(key):
+    write_function, target_table, kwargs = key
+    df = pd.concat(WRITE_BUFFER.pop(key), ignore_index=True)
+
+    print(f'Flush write buffer - {target_table} : {len(df)} rows')
+    write_function(df, target_table=target_table, **{k: list(v) if isinstance(v, tuple) else v for k, v in kwargs})
+
+def buffer_write(write_function, df, target_table, max_rows=WRITE_BUFFER_MAX_ROWS, **kwargs):
+    """
+    Add df to the write buffer of target_table, it is written with write_function(df, target_table=target_table, **kwargs)
+    by flush_write_buffer, or as soon as the buffer of this target has max_rows rows.
+
+    Parameters:
+    write_function : write_table_by_partition / write_table_by_unique_id / ..., the frames buffered with the same
+                     write_function, target_table and kwargs are concatenated and written together
+    kwargs : the other arguments of write_function, for example write_method = 'append'
+    """
+    if len(df) == 0:
+        return
+
+    key = get_write_buffer_key(write_function, target_table, kwargs)
+    WRITE_BUFFER.setdefault(key, []).append(df)
+
+    if sum(len(frame) for frame in WRITE_BUFFER[key]) >= max_rows:
+        write_buffer_entry(key)
+
+def flush_write_buffer(target_table=None):
+    """
+    Write the buffered frames of target_table (every target by default).
+    """
+    for key in [key for key in WRITE_BUFFER if target_table in (None, key[1])]:
+        write_buffer_entry(key)
+
+# # Example Usage:
+# for folder in folder_list:
+#     buffer_write(write_table_by_partition, df_folder, 'report_rc.rpt_sp_journal_base', write_method='append')
+# flush_write_buffer() # one DELETE + load per month partition for every folder
+
 # GOOGLE SHEETS & GOOGLE DRIVE
 gs_credentials = ServiceAccountCredentials.from_json_keyfile_dict(service_account_bi, ['https://spreadsheets.google.com/feeds'])
 gs_client = gspread.authorize(gs_credentials)
@@ -267,11 +978,216 @@ def safe_divide_optimized(numerator, denominator): # example : df['result'] = sa
     result = np.where(((numerator == 0) & (denominator == 0)), 0, result)
     return result
 
+# EXCEL INTEGRITY CHECK
+# Structural check of the file container, then the workbook is opened with openpyxl (same engine and mode as the raw file read)
+# without reading the cells, so the files that openpyxl can not open (for example broken styles) are repaired.
+# The results are cached by file content hash.
+# format : {"content_hash" : "" (valid) or error message}
+
+EXCEL_CHECK_CACHE_FILE = os.path.join(BI_CACHE_PATH, 'excel_check_cache_v2.json') # v2 : with the openpyxl open, the results without it are not used
+OLE_SIGNATURE = b'\xd0\xcf\x11\xe0\xa1\xb1\x1a\xe1'
+
+def check_xml_part(zip_file, name):
+    # Stream parse the XML part, every element is dropped once parsed so big sheets use little memory
+    with zip_file.open(name) as f:
+        for _, elem in ElementTree.iterparse(f):
+            elem.clear()
+
+def check_excel_structure(path):
+    """
+    Return '' when the file structure is valid, otherwise the error message.
+    - .xlsx / .xlsm : zip container, workbook, every worksheet XML and the shared strings / styles parts are well formed
+                      (the zip CRC of every part is checked while reading), then the workbook is opened with openpyxl
+                      and the dimension of every sheet is read, the cells are not read
+    - .xls : OLE2 file signature
+    """
+    extension = os.path.splitext(path)[1].lower()
+
+    try:
+        if extension == '.xls':
+            with open(path, 'rb') as f:
+                return '' if f.read(len(OLE_SIGNATURE)) == OLE_SIGNATURE else 'not an OLE2 (.xls) file'
+
+        with zipfile.ZipFile(path) as zip_file:
+            names = set(zip_file.namelist())
+
+            for name in ['[Content_Types].xml', 'xl/workbook.xml', 'xl/_rels/workbook.xml.rels']:
+                if name not in names:
+                    return f'missing part {name}'
+
+            rels = ElementTree.fromstring(zip_file.read('xl/_rels/workbook.xml.rels'))
+            sheet_parts = [rel.get('Target') for rel in rels if (rel.get('Type') or '').endswith('/worksheet')]
+            if not sheet_parts:
+                return 'no worksheet in the workbook'
+
+            check_xml_part(zip_file, 'xl/workbook.xml')
+
+            for target in sheet_parts:
+                name = target.lstrip('/') if target.startswith('/') else f'xl/{target}'
+                if name not in names:
+                    return f'missing worksheet part {name}'
+                check_xml_part(zip_file, name)
+
+            for name in ['xl/sharedStrings.xml', 'xl/styles.xml']:
+                if name in names:
+                    check_xml_part(zip_file, name)
+
+    except (zipfile.BadZipFile, ElementTree.ParseError, OSError, EOFError, zlib.error) as e:
+        return f'{type(e).__name__}: {str(e)}'
+
+    # Well formed XML can still fail in openpyxl (for example the styles), open it the same way as iter_excel_sheet / pd.read_excel
+    try:
+        workbook = load_workbook(filename=path, read_only=True, data_only=True)
+        try:
+            for worksheet in workbook.worksheets:
+                worksheet.max_row # only reads the dimension element at the start of the sheet, None when the sheet has none
+        finally:
+            workbook.close()
+    except Exception as e:
+        return f'openpyxl {type(e).__name__}: {str(e)}'
+
+    return ''
+
+def check_excel_files(file_list, cache_file=EXCEL_CHECK_CACHE_FILE):
+    """
+    Run check_excel_structure for every file, files with the same content as an already checked file are not opened again.
+
+    Returns:
+    dictionary of {file_path: '' (valid) or error message}
+    """
+    cache = {}
+    if os.path.exists(cache_file):
+        try:
+            with open(cache_file, 'r') as f:
+                cache = json.load(f)
+        except (OSError, json.JSONDecodeError) as e:
+            print(f"\033[1;31mFailed to read the excel check cache, the files will be checked again: {cache_file}. Error: {e}\033[0m")
+
+    results = {}
+    is_updated = False
+
+    for path in file_list:
+        content_hash = get_file_hash(path)
+        if content_hash not in cache:
+            cache[content_hash] = check_excel_structure(path)
+            is_updated = True
+        results[path] = cache[content_hash]
+
+    if is_updated:
+        os.makedirs(os.path.dirname(cache_file), exist_ok=True)
+        temp_file = cache_file + '.tmp'
+        with open(temp_file, 'w') as f:
+            json.dump(cache, f)
+        os.replace(temp_file, cache_file)
+
+    return results
+
 # FIX BROKEN EXCEL
 
-def fix_broken_excel(list_of_path, num_files=1):
-    libreoffice_command = "soffice" if platform.system() == "Windows" else "libreoffice"
+LIBREOFFICE_COMMAND = "soffice" if platform.system() == "Windows" else "libreoffice"
+LIBREOFFICE_PROFILE_PATH = os.path.join(BI_CACHE_PATH, 'libreoffice_profile')
+
+def convert_with_libreoffice(file_list, convert_to, outdir, profile_dir, timeout=600):
+    """
+    Convert every file in file_list with one headless LibreOffice process, so the start up cost is paid once per batch.
+    Each worker uses its own user profile (kept between runs), parallel LibreOffice processes can not share one.
+
+    Returns True when LibreOffice finished before the timeout (the output files still need to be checked).
+    """
+    try:
+        subprocess.run([LIBREOFFICE_COMMAND, f'-env:UserInstallation={Path(profile_dir).resolve().as_uri()}', "--headless",
+                        "--convert-to", convert_to, "--outdir", outdir] + file_list, timeout=timeout)
+        return True
+    except subprocess.TimeoutExpired:
+        print(f'* Error: LibreOffice did not finish in {timeout} seconds, {len(file_list)} files in : {outdir}')
+        return False
+
+def run_libreoffice_jobs(jobs, max_workers=2, timeout=600):
+    """
+    Run the conversion jobs [(file_list, convert_to, outdir)] on a pool of max_workers LibreOffice workers.
+    """
+    profile_queue = queue.Queue()
+    for idx in range(max_workers):
+        profile_queue.put(os.path.join(LIBREOFFICE_PROFILE_PATH, str(idx)))
+
+    def run_job(job):
+        profile_dir = profile_queue.get()
+        try:
+            return convert_with_libreoffice(*job, profile_dir=profile_dir, timeout=timeout)
+        finally:
+            profile_queue.put(profile_dir)
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        list(executor.map(run_job, jobs))
+
+def get_libreoffice_jobs(file_convert_list, batch_size):
+    # Group [(file_path, convert_to)] by output folder and format, in batches of batch_size files
+    groups = {}
+    for file_path, convert_to in file_convert_list:
+        groups.setdefault((os.path.dirname(file_path), convert_to), []).append(file_path)
+
+    return [(file_list[start:start + batch_size], convert_to, folder)
+            for (folder, convert_to), file_list in groups.items()
+            for start in range(0, len(file_list), batch_size)]
+
+def repair_with_libreoffice(file_list, max_workers=2, batch_size=20, timeout=600):
+    """
+    Repair broken .xlsx / .xls files by converting them to the other format and back with LibreOffice.
+    The repaired file is saved next to the original as <name>_clean.xlsx (or <name>_clean.xls).
+
+    Parameters:
+    max_workers : number of LibreOffice processes running in parallel
+    batch_size : number of files converted by one LibreOffice process
+
+    Returns:
+    dictionary of {file_path: 'success' or error message}
+    """
+    other_format = {'.xlsx': 'xls', '.xls': 'xlsx'}
+    results = {}
+    steps = {}
+
+    for file_path in file_list:
+        base_path, extension = os.path.splitext(file_path)
+        if extension not in other_format:
+            results[file_path] = f'unsupported file format {extension}'
+            continue
+        steps[file_path] = (f'{base_path}.{other_format[extension]}',  # converted file
+                            f'{base_path}_clean.{other_format[extension]}',  # converted file, renamed
+                            f'{base_path}_clean{extension}',  # repaired file
+                            extension.lstrip('.'))
+
+    # Step 1 : convert to the other format
+    run_libreoffice_jobs(get_libreoffice_jobs([(file_path, other_format[os.path.splitext(file_path)[1]]) for file_path in steps], batch_size),
+                         max_workers, timeout)
+
+    converted_files = []
+    for file_path, (new_file_path, expected_file_path, clean_file_path, extension) in steps.items():
+        if os.path.exists(new_file_path):
+            os.replace(new_file_path, expected_file_path)
+            converted_files.append(file_path)
+        else:
+            results[file_path] = 'conversion process was not successful'
+
+    # Step 2 : convert back to the original format
+    run_libreoffice_jobs(get_libreoffice_jobs([(steps[file_path][1], steps[file_path][3]) for file_path in converted_files], batch_size),
+                         max_workers, timeout)
+
+    for file_path in converted_files:
+        new_file_path, expected_file_path, clean_file_path, extension = steps[file_path]
+        if os.path.exists(expected_file_path):
+            os.remove(expected_file_path)
+        results[file_path] = 'success' if os.path.exists(clean_file_path) else 'conversion back to the original format was not successful'
+
+    return results
+
+def fix_broken_excel(list_of_path, num_files=1, max_workers=2, batch_size=20):
+    """
+    Check the structure of the latest num_files files of every folder (see check_excel_files).
+    Invalid files are opened and saved with openpyxl, the files that still fail are repaired
+    with a pool of max_workers LibreOffice processes (see repair_with_libreoffice).
+    """
     input_folders = list_of_path
+    broken_files = []
 
     for folder in input_folders:
         # Exclude files ending with ".backup" from the list and files with "_clean"
@@ -289,95 +1205,580 @@ def fix_broken_excel(list_of_path, num_files=1):
             print(f'There are no files in folder : {folder}')
             continue
 
-        for file_path in input_files:
+        # Only the files that fail the structure check are opened and saved, valid files are left untouched
+        for file_path, error in check_excel_files(input_files).items():
+            if not error:
+                print(f'* Valid file structure, nothing to fix for : {file_path}')
+                continue
+
+            print(f'* Invalid file structure ({error}) for : {file_path}')
+
             # Backup original file only if a backup doesn't already exist
             backup_path = file_path + ".backup"
             if not os.path.exists(backup_path) and not "_clean." in file_path:
                 shutil.copy(file_path, backup_path)
 
             try:
-                try:
-                    # Attempt to load and save with openpyxl
-                    wb = load_workbook(filename=file_path)
-                    wb.save(file_path)
-                    print(f'* Success to run open and save action for : {file_path}')
+                # Attempt to load and save with openpyxl
+                wb = load_workbook(filename=file_path)
+                wb.save(file_path)
+                print(f'* Success to run open and save action for : {file_path}')
+
+            except:
+                print(f'* Failed to run open and save action for : {file_path}')
+                if file_path.endswith(('.xlsx', '.xls')):
+                    broken_files.append(file_path)
+
+    if broken_files:
+        print(f'* Continue the process using convert method for {len(broken_files)} files')
 
-                except:
-                    print(f'* Failed to run open and save action for : {file_path}')
-                    print(f'* Continue the process using convert method for : {file_path}')
+        for file_path, result in repair_with_libreoffice(broken_files, max_workers, batch_size).items():
+            if result == 'success':
+                print(f'* Finish to convert and clean the new file : {file_path}')
+            else:
+                print(f"* Error: {result} : {file_path}")
 
-                    if file_path.endswith('.xlsx'):
+    finish_time = datetime.now() + timedelta(hours=(7 if platform.system() != "Windows" else 0))
+    print(f'Fixing excel file process end at : {finish_time.strftime("%Y-%m-%d %H:%M")}')
 
-                        subprocess.run(
-                            [libreoffice_command, "--headless", "--convert-to", "xls", file_path, "--outdir", folder])
-                        print(f'* New file is created')
+# RAW FILE CATALOG
+# The raw file folders are listed with one os.scandir pass and the stat results are saved between runs.
+# A folder is only scanned again when its own mtime changes (a file was added, removed or renamed).
+# format : {"folder" : {"folder_mtime", "files" : {"file_name" : [size, mtime]}}}
 
-                        new_file_path = file_path.replace('.xlsx', '.xls')
-                        expected_file_path = new_file_path.replace('.xls', '_clean.xls')
+RAW_FILE_CATALOG_FILE = os.path.join(BI_CACHE_PATH, 'raw_file_catalog.json')
+RAW_FILE_EXTENSIONS = ('.xlsx', '.csv', '.xls')
 
-                        if os.path.exists(new_file_path):
-                            os.rename(new_file_path, expected_file_path)
+def load_raw_file_catalog(catalog_file=RAW_FILE_CATALOG_FILE):
+    if not os.path.exists(catalog_file):
+        return {}
 
-                            subprocess.run(
-                                [libreoffice_command, "--headless", "--convert-to", "xlsx", expected_file_path,
-                                 "--outdir", folder])
-                            os.remove(expected_file_path)
+    try:
+        with open(catalog_file, 'r') as f:
+            return json.load(f)
+    except (OSError, json.JSONDecodeError) as e:
+        print(f"\033[1;31mFailed to read the raw file catalog, the folders will be scanned again: {catalog_file}. Error: {e}\033[0m")
+        return {}
 
-                            print(f'* Finish to convert and clean the new file')
-                            print()
+def save_raw_file_catalog(catalog, catalog_file=RAW_FILE_CATALOG_FILE):
+    os.makedirs(os.path.dirname(catalog_file), exist_ok=True)
 
-                        else:
-                            print(f"* Error: Conversion process was not successful : {file_path}")
-                            print()
+    temp_file = catalog_file + '.tmp'
+    with open(temp_file, 'w') as f:
+        json.dump(catalog, f)
+    os.replace(temp_file, catalog_file)
 
-                    elif file_path.endswith('.xls'):
+def scan_raw_file_folder(folder):
+    files = {}
 
-                        subprocess.run(
-                            [libreoffice_command, "--headless", "--convert-to", "xlsx", file_path, "--outdir", folder])
-                        print(f'* New file is created')
+    with os.scandir(folder) as entries:
+        for entry in entries:
+            # Same files as glob('*.xlsx'), glob('*.csv') and glob('*.xls') : hidden files are skipped
+            if entry.name.startswith('.') or not entry.name.endswith(RAW_FILE_EXTENSIONS) or not entry.is_file():
+                continue
+            stat = entry.stat()
+            files[entry.name] = [stat.st_size, stat.st_mtime]
 
-                        new_file_path = file_path.replace('.xls', '.xlsx')
-                        expected_file_path = new_file_path.replace('.xlsx', '_clean.xlsx')
+    return files
 
-                        if os.path.exists(new_file_path):
-                            os.rename(new_file_path, expected_file_path)
+def get_raw_file_catalog(local_path_list, refresh=False):
+    """
+    Return {folder: {file_name: [size, mtime]}} for the existing folders in local_path_list.
 
-                            subprocess.run(
-                                [libreoffice_command, "--headless", "--convert-to", "xls", expected_file_path,
-                                 "--outdir", folder])
-                            os.remove(expected_file_path)
+    Parameters:
+    refresh : True scans every folder again, needed when a file was overwritten in place
+              (the folder mtime does not change in that case)
+    """
+    catalog = load_raw_file_catalog()
+    folder_files = {}
+    is_updated = False
 
-                            print(f'* Finish to convert and clean the new file')
-                            print()
+    for folder in local_path_list:
+        try:
+            folder_mtime = os.stat(folder).st_mtime
+        except OSError:
+            continue # folder does not exist
 
-                        else:
-                            print(f"* Error: Conversion process was not successful : {file_path}")
-                            print()
+        record = catalog.get(folder)
 
-            except Exception as e:
-                print(f"Error processing {file_path}. Error: {e}")
+        if refresh or not record or record['folder_mtime'] != folder_mtime:
+            record = {'folder_mtime': folder_mtime, 'files': scan_raw_file_folder(folder)}
+            catalog[folder] = record
+            is_updated = True
 
-    finish_time = datetime.now() + timedelta(hours=(7 if platform.system() != "Windows" else 0))
-    print(f'Fixing excel file process end at : {finish_time.strftime("%Y-%m-%d %H:%M")}')
+        folder_files[folder] = record['files']
 
-def get_latest_file_multiple_folder(local_path_list, n=1):
+    if is_updated:
+        save_raw_file_catalog(catalog)
 
-    final_file_list = []
+    return folder_files
 
-    # Helper function to get latest files from a given path
-    def get_latest_files(path, n):
-        all_files = glob.glob(path + '*.xlsx') + glob.glob(path + '*.csv') + glob.glob(path + '*.xls')
-        if all_files:
-            sorted_files = sorted(all_files, key=os.path.getmtime, reverse=True)
-            return sorted_files[:n]
-        return []
+def get_latest_file_multiple_folder(local_path_list, n=1, refresh=False):
+    """
+    Return the n latest modified raw files (.xlsx, .csv, .xls) of every folder, folder by folder, newest first.
+    """
+    final_file_list = []
 
-    for path in local_path_list:
-        if os.path.exists(path):
-            final_file_list.extend(get_latest_files(path, n))
+    for folder, files in get_raw_file_catalog(local_path_list, refresh).items():
+        latest_files = sorted(files.items(), key=lambda item: item[1][1], reverse=True)[:n]
+        final_file_list.extend(os.path.join(folder, name) for name, _ in latest_files)
 
     return final_file_list
 
+def get_file_changed_since(local_path_list, watermark, refresh=False):
+    """
+    Return the raw files modified after watermark (timestamp, for example the start time of the last run), oldest first.
+    """
+    changed_files = [(mtime, os.path.join(folder, name))
+                     for folder, files in get_raw_file_catalog(local_path_list, refresh).items()
+                     for name, (size, mtime) in files.items() if mtime > watermark]
+
+    return [path for _, path in sorted(changed_files)]
+
+# FILE HASH
+
+def get_file_hash(path, chunk_size=1024 * 1024):
+    """
+    Return the sha256 hex digest of the file content, read in chunks so big exports do not need to fit in memory.
+    """
+    file_hash = hashlib.sha256()
+
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            file_hash.update(chunk)
+
+    return file_hash.hexdigest()
+
+# RAW FILE READ (EXCEL / CSV)
+
+# Same default NA strings as pd.read_excel, so the streamed values match the normal read
+EXCEL_NA_VALUES = {'', '#N/A', '#N/A N/A', '#NA', '-1.#IND', '-1.#QNAN', '-NaN', '-nan', '1.#IND', '1.#QNAN',
+                   '<NA>', 'N/A', 'NA', 'NULL', 'NaN', 'None', 'n/a', 'nan', 'null'}
+
+def convert_excel_value(value):
+    if value is None:
+        return None
+
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+
+    value = str(value)
+
+    return None if value in EXCEL_NA_VALUES else value
+
+def get_header_names(values):
+    names = []
+    for idx, value in enumerate(values):
+        name = value if value is not None else f'Unnamed: {idx}'
+        # Rename duplicate column names the same way pandas does : name, name.1, name.2
+        dup_count = 0
+        unique_name = name
+        while unique_name in names:
+            dup_count += 1
+            unique_name = f'{name}.{dup_count}'
+        names.append(unique_name)
+    return names
+
+def iter_excel_sheet(path, sheet_name=0, header=0, chunk_size=None, usecols=None):
+    """
+    Yield the sheet content as DataFrame with every value as string, like pd.read_excel(dtype=str).
+
+    Parameters:
+    sheet_name : sheet index, sheet name, list of sheet names,
+                 or a function that receives all sheet names and returns the list of sheet names to read
+    header : row number (0-indexed) to use as the column names
+    chunk_size : None (default) reads each sheet at once. If set, .xlsx files are streamed row by row in
+                 read-only mode and yielded as DataFrame chunks of at most chunk_size rows, so the memory
+                 used does not grow with the row count. Other formats (.xls) are read at once and split.
+    usecols : optional function that receives a column name and returns True for the columns to keep,
+              the other columns are not parsed at all
+    """
+
+    def get_sheet_list(all_sheet_names):
+        if callable(sheet_name):
+            return sheet_name(all_sheet_names)
+        elif isinstance(sheet_name, list):
+            return sheet_name
+        elif isinstance(sheet_name, int):
+            return [all_sheet_names[sheet_name]]
+        return [sheet_name]
+
+    def trim_row(values):
+        while values and values[-1] is None:
+            values.pop()
+        return values
+
+    def build_chunk(rows, columns):
+        width = max([len(columns)] + [len(row) for row in rows])
+        columns = columns + [f'Unnamed: {idx}' for idx in range(len(columns), width)]
+        return pd.DataFrame([row + [None] * (width - len(row)) for row in rows], columns=columns, dtype=object)
+
+    if not chunk_size or not path.lower().endswith(('.xlsx', '.xlsm')):
+        with pd.ExcelFile(path) as excel_file:
+            for name in get_sheet_list(excel_file.sheet_names):
+                df = excel_file.parse(name, header=header, dtype=str, usecols=usecols)
+                if not chunk_size:
+                    yield df
+                    continue
+                for start in range(0, max(len(df), 1), chunk_size):
+                    yield df.iloc[start:start + chunk_size]
+        return
+
+    workbook = load_workbook(filename=path, read_only=True, data_only=True)
+
+    try:
+        for name in get_sheet_list(workbook.sheetnames):
+            columns = None
+            keep_idx = None
+            rows = []
+            blank_rows = 0 # blank rows are only kept when there is data below them, like pd.read_excel
+            has_yielded = False
+
+            for idx, row in enumerate(workbook[name].iter_rows(values_only=True)):
+                if idx < header:
+                    continue
+
+                if columns is None:
+                    columns = get_header_names(trim_row([convert_excel_value(value) for value in row]))
+
+                    if usecols is not None:
+                        keep_idx = [idx for idx, col in enumerate(columns) if usecols(col)]
+                        columns = [columns[idx] for idx in keep_idx]
+                    continue
+
+                if keep_idx is not None:
+                    values = trim_row([convert_excel_value(row[idx]) if idx < len(row) else None for idx in keep_idx])
+                else:
+                    values = trim_row([convert_excel_value(value) for value in row])
+
+                if not values:
+                    blank_rows += 1
+                    continue
+
+                rows.extend([] for _ in range(blank_rows))
+                blank_rows = 0
+                rows.append(values)
+
+                if len(rows) >= chunk_size:
+                    yield build_chunk(rows, columns)
+                    has_yielded = True
+                    rows = []
+
+            if columns is None:
+                raise ValueError(f'Sheet {name} has less than {header + 1} rows, the header row is not found')
+
+            if rows or not has_yielded:
+                yield build_chunk(rows, columns)
+    finally:
+        workbook.close()
+
+def iter_csv_file(path, header=0, chunk_size=None, usecols=None):
+    """
+    Yield the CSV content as DataFrame with every value as string, using the multi-threaded pyarrow CSV reader.
+
+    The header row is read first, so every column gets an explicit string type and pyarrow never infers types
+    (type inference would turn '1.000' into 1.0). Parameters are the same as iter_excel_sheet.
+    """
+    with open(path, newline='', encoding='utf-8-sig') as f:
+        header_row = next((row for idx, row in enumerate(csv.reader(f)) if idx == header), None)
+
+    if header_row is None:
+        raise ValueError(f'CSV file has less than {header + 1} rows, the header row is not found')
+
+    columns = get_header_names([convert_excel_value(value) for value in header_row])
+    keep_columns = [col for col in columns if usecols is None or usecols(col)]
+
+    read_options = pa_csv.ReadOptions(column_names=columns, skip_rows=header + 1, use_threads=True)
+    convert_options = pa_csv.ConvertOptions(column_types={col: pa.string() for col in keep_columns},
+                                            include_columns=keep_columns,
+                                            null_values=list(EXCEL_NA_VALUES),
+                                            strings_can_be_null=True,
+                                            quoted_strings_can_be_null=True)
+
+    if not chunk_size:
+        yield pa_csv.read_csv(path, read_options=read_options, convert_options=convert_options).to_pandas()
+        return
+
+    # Streaming mode : collect record batches until chunk_size rows, then yield them as one DataFrame
+    reader = pa_csv.open_csv(path, read_options=read_options, convert_options=convert_options)
+    batches = []
+    batch_rows = 0
+    has_yielded = False
+
+    for batch in reader:
+        batches.append(batch)
+        batch_rows += batch.num_rows
+
+        if batch_rows >= chunk_size:
+            yield pa.Table.from_batches(batches).to_pandas()
+            has_yielded = True
+            batches = []
+            batch_rows = 0
+
+    if batches or not has_yielded:
+        yield pa.Table.from_batches(batches, schema=reader.schema).to_pandas()
+
+def iter_raw_file(path, sheet_name=0, header=0, chunk_size=None, usecols=None):
+    """
+    Yield the raw file content as string DataFrame, dispatched by file format:
+    .csv files go through iter_csv_file (sheet_name is ignored), the others through iter_excel_sheet.
+    """
+    if path.lower().endswith('.csv'):
+        yield from iter_csv_file(path, header=header, chunk_size=chunk_size, usecols=usecols)
+    else:
+        yield from iter_excel_sheet(path, sheet_name=sheet_name, header=header, chunk_size=chunk_size, usecols=usecols)
+
+def read_raw_head_rows(path, sheet_name=0, nrows=50):
+    """
+    Return the first nrows rows of the raw file as lists of strings (None for empty cells), without any header.
+    The row numbers are the same as the header parameter of iter_raw_file.
+
+    Parameters:
+    sheet_name : same as iter_excel_sheet, only the first selected sheet is read (ignored for .csv files)
+    """
+    return read_raw_head_sheet(path, sheet_name, nrows)[1]
+
+def read_raw_head_sheet(path, sheet_name=0, nrows=50):
+    """
+    Same as read_raw_head_rows, returns (name of the sheet that was read, rows). The name is 'csv' for .csv files
+    and None when sheet_name selects no sheet.
+    """
+    if path.lower().endswith('.csv'):
+        with open(path, newline='', encoding='utf-8-sig') as f:
+            return 'csv', [[convert_excel_value(value) for value in row] for _, row in zip(range(nrows), csv.reader(f))]
+
+    def get_first_sheet(all_sheet_names):
+        if callable(sheet_name):
+            sheet_list = sheet_name(all_sheet_names)
+        elif isinstance(sheet_name, list):
+            sheet_list = sheet_name
+        elif isinstance(sheet_name, int):
+            sheet_list = [all_sheet_names[sheet_name]]
+        else:
+            sheet_list = [sheet_name]
+        return sheet_list[0] if sheet_list else None
+
+    if path.lower().endswith(('.xlsx', '.xlsm')):
+        workbook = load_workbook(filename=path, read_only=True, data_only=True)
+        try:
+            name = get_first_sheet(workbook.sheetnames)
+            if name is None:
+                return None, []
+            return name, [[convert_excel_value(value) for value in row]
+                          for row in workbook[name].iter_rows(max_row=nrows, values_only=True)]
+        finally:
+            workbook.close()
+
+    with pd.ExcelFile(path) as excel_file:
+        name = get_first_sheet(excel_file.sheet_names)
+        if name is None:
+            return None, []
+        df = excel_file.parse(name, header=None, nrows=nrows, dtype=str)
+        return name, [[value if isinstance(value, str) else None for value in row] for row in df.values.tolist()]
+
+# DATA TYPE COERCION
+
+DATETIME_FORMAT_CACHE = {} # {(cache_key, column_name): format string}, detected once per process and reused for the next files
+DATETIME_PLACEHOLDERS = ['', '-', '--'] # values used for an empty date in the exports, not used to detect or check the format
+
+def coerce_number_columns(df, columns, thousands_sep='.', decimal_sep=','):
+    """
+    Convert formatted number string columns (for example '1.234.500,50' or '1,234,500.50') to float
+    in one vectorized pass over all the columns, instead of one replace and astype per column.
+    Raises ValueError when a value is not a number or an empty string, like astype(float).
+    """
+    if not columns:
+        return df
+
+    if len(df) == 0:
+        df[columns] = df[columns].astype(float)
+        return df
+
+    values = pd.Series(df[columns].to_numpy(dtype=object).ravel())
+    values = values.str.strip().str.translate(str.maketrans({thousands_sep: None, decimal_sep: '.'}))
+
+    # pd.to_numeric reads '' as NaN, astype(float) raises
+    if (values == '').any():
+        raise ValueError("could not convert string to float: ''")
+
+    numbers = pd.to_numeric(values, errors='raise').astype(float).to_numpy().reshape(len(df), len(columns))
+    df[columns] = pd.DataFrame(numbers, index=df.index, columns=columns)
+
+    return df
+
+def coerce_datetime_columns(df, columns, cache_key=None):
+    """
+    Convert string columns to datetime with an explicit format string. The format is detected once from the
+    first value and cached per cache_key + column name, so the next chunks and files skip the detection.
+    Placeholder values (DATETIME_PLACEHOLDERS) and unparseable values become NaT, the same as pd.to_datetime(errors='coerce').
+
+    Parameters:
+    cache_key : name of the caller (for example the loader), files of different loaders do not share a format
+    """
+    for col in columns:
+        values = df[col]
+        is_date = values.notna() & ~values.astype(str).str.strip().isin(DATETIME_PLACEHOLDERS)
+        first_value = values[is_date]
+        first_value = first_value.iloc[0] if len(first_value) > 0 else None
+
+        date_format = DATETIME_FORMAT_CACHE.get((cache_key, col))
+        if date_format is None and isinstance(first_value, str):
+            date_format = guess_datetime_format(first_value)
+
+        if date_format is not None:
+            parsed = pd.to_datetime(values.where(is_date), format=date_format, errors='coerce')
+
+            # The format matched every value that is not a placeholder, keep it for the next files
+            if parsed.notna().sum() == is_date.sum():
+                DATETIME_FORMAT_CACHE[(cache_key, col)] = date_format
+                df[col] = parsed
+                continue
+
+            DATETIME_FORMAT_CACHE.pop((cache_key, col), None)
+
+        df[col] = pd.to_datetime(values, errors='coerce')
+
+    return df
+
+# STORE DIMENSION
+# format of store_dim : {folder_id : [store_id, country, currency, platform, store]}, for example rc_shopee_store_info
+
+STORE_DIM_COLUMNS = ['store_id', 'country', 'currency', 'platform', 'store', 'folder_id']
+
+def get_store_dim_dtypes(store_dim):
+    """
+    Return {column: CategoricalDtype} for the store dimension columns, with the categories of the whole store registry.
+    Every file gets the same categories, so pd.concat keeps the columns categorical.
+    """
+    dim_values = [list(info[:5]) + [folder_id] for folder_id, info in store_dim.items()]
+
+    return {col: pd.CategoricalDtype(sorted({values[idx] for values in dim_values if values[idx] is not None}, key=str))
+            for idx, col in enumerate(STORE_DIM_COLUMNS)}
+
+def insert_store_dim(df, store_dim, folder_id, loc):
+    """
+    Insert the store dimension columns of folder_id as categorical columns, starting at position loc.
+    Each column only stores one small integer code per row instead of a repeated string.
+    """
+    dim_dtypes = get_store_dim_dtypes(store_dim)
+    dim_values = list(store_dim[folder_id][:5]) + [folder_id]
+
+    for idx, col in enumerate(STORE_DIM_COLUMNS):
+        dtype = dim_dtypes[col]
+        code = dtype.categories.get_loc(dim_values[idx]) if dim_values[idx] is not None else -1
+        df.insert(loc + idx, col, pd.Categorical.from_codes(np.full(len(df), code), dtype=dtype))
+
+    return df
+
+# PARALLEL FILE READ
+
+def iter_files_parallel(read_function, file_list, max_workers=1, **kwargs):
+    """
+    Yield (path, df, error) for every file in file_list, in the same order, optionally spread across a process pool.
+    At most 2 x max_workers files are parsed ahead of the caller, so the memory used does not grow with the file count.
+
+    Parameters:
+    read_function : module level function (must be picklable) called as read_function(path, **kwargs), returns a DataFrame,
+                    it should raise when the file cannot be read (a DataFrame without any column is also a failure)
+    file_list : list of file paths
+    max_workers : number of worker processes. 1 (default) reads the files one by one in the current process,
+                  None uses all available cores
+    kwargs : extra arguments passed to read_function, for example store_dim
+
+    Yields:
+    (path, df, error) : df is an empty DataFrame and error the error message when read_function raised an exception
+                        or returned a DataFrame without any column
+    """
+
+    def get_result(path, read):
+        try:
+            df = read()
+            if len(df.columns) == 0:
+                raise ValueError('no column was read from the file')
+            return path, df, None
+        except Exception as e:
+            print(f'\033[1;31m--Failed to process the file: {path}. Error: {str(e)}\033[0m')
+            return path, pd.DataFrame(), str(e)
+
+    if (max_workers is None or max_workers > 1) and len(file_list) > 1:
+        with ProcessPoolExecutor(max_workers=max_workers) as executor:
+            read_ahead = (max_workers or os.cpu_count() or 1) * 2
+            futures = {}
+
+            for idx, path in enumerate(file_list):
+                # Keep the pool busy with the next files while the caller handles this one
+                for next_idx in range(idx, min(idx + read_ahead, len(file_list))):
+                    if next_idx not in futures:
+                        futures[next_idx] = executor.submit(read_function, file_list[next_idx], **kwargs)
+
+                yield get_result(path, futures.pop(idx).result)
+    else:
+        for path in file_list:
+            yield get_result(path, lambda: read_function(path, **kwargs))
+
+def read_files_parallel(read_function, file_list, max_workers=1, **kwargs):
+    """
+    Run read_function for every file in file_list, optionally spread across a process pool.
+    Parameters are the same as iter_files_parallel.
+
+    Returns:
+    df_list : list of DataFrame in the same order as file_list (empty DataFrame for the failed files)
+    read_errors : dictionary of {path: error message} for the files that raised an exception
+    """
+
+    df_list = []
+    read_errors = {}
+
+    for path, df, error in iter_files_parallel(read_function, file_list, max_workers, **kwargs):
+        df_list.append(df)
+        if error is not None:
+            read_errors[path] = error
+
+    return df_list, read_errors
+
+def raise_read_errors(read_errors, target_table):
+    """
+    Raise one error listing the files that failed to read, to be called after the other files are loaded,
+    so the run is reported as failed (see log_function) instead of looking clean.
+    """
+    if read_errors:
+        failed_files = '; '.join(f'{path}: {error}' for path, error in read_errors.items())
+        raise RuntimeError(f'{len(read_errors)} files failed to read and were not loaded to {target_table} : {failed_files}')
+
+def read_files_in_batches(read_function, file_list, row_budget, parsed_columns, max_workers=1, read_errors=None, **kwargs):
+    """
+    Yield the parsed files concatenated in batches of about row_budget rows, in file_list order,
+    so only one batch (plus the files parsed ahead) is kept in memory.
+
+    Parameters:
+    row_budget : a batch is yielded as soon as it has at least row_budget rows
+    parsed_columns : list filled with a zero-row DataFrame for every file (same columns as the parsed file,
+                     no column for the failed files), to be passed to record_loaded_files as df_list
+    read_errors : optional dictionary filled with {path: error message} for the files that raised an exception
+    other parameters : same as iter_files_parallel
+    """
+    batch = []
+    batch_rows = 0
+
+    for path, df, error in iter_files_parallel(read_function, file_list, max_workers, **kwargs):
+        parsed_columns.append(df.head(0))
+        if error is not None and read_errors is not None:
+            read_errors[path] = error
+
+        if len(df.columns) == 0:
+            continue
+
+        batch.append(df)
+        batch_rows += len(df)
+
+        if batch_rows >= row_budget:
+            yield pd.concat(batch, ignore_index=True)
+            batch = []
+            batch_rows = 0
+
+    if batch:
+        yield pd.concat(batch, ignore_index=True)
+
 # LOG FUNCTION
 
 def log_function(script_function_list):
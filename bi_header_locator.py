@@ -0,0 +1,123 @@
+import os
+import json
+import hashlib
+
+from bi_function import BI_CACHE_PATH, read_raw_head_sheet
+
+# HEADER ROW LOCATOR
+# The header row of an export is found by scanning the first rows for the known column headers,
+# and the offsets are cached per (source, layout), so a shifted preamble does not break the load.
+# format : {"source" : {"layout" : [header_row, ...]}}
+# layout : file extension + name of the sheet that was read + fingerprint of the header row, for example 'xlsx|Income|3f2a...'
+#          files with the same sheet name but another header (columns added, renamed or moved) get their own entry,
+#          files with the same header but another preamble length add their offset to the list of the layout
+
+HEADER_CACHE_FILE = os.path.join(BI_CACHE_PATH, 'header_row_cache.json')
+HEADER_SCAN_ROWS = 50
+
+HEADER_ROW_CACHE = {} # loaded from HEADER_CACHE_FILE once per process
+
+def load_header_cache(cache_file=HEADER_CACHE_FILE):
+    if HEADER_ROW_CACHE:
+        return HEADER_ROW_CACHE
+
+    if os.path.exists(cache_file):
+        try:
+            with open(cache_file, 'r') as f:
+                HEADER_ROW_CACHE.update(json.load(f))
+        except (OSError, json.JSONDecodeError) as e:
+            print(f"\033[1;31mFailed to read the header row cache, the header rows will be detected again: {cache_file}. Error: {e}\033[0m")
+
+    return HEADER_ROW_CACHE
+
+def get_cached_offsets(value):
+    # Cache files written before the offset lists store a single header row per layout
+    return value if isinstance(value, list) else [value]
+
+def add_cached_offset(layouts, layout, header_row):
+    offsets = get_cached_offsets(layouts.get(layout, []))
+    layouts[layout] = sorted(set(offsets) | {header_row})
+
+def save_header_cache(source, layout, header_row, cache_file=HEADER_CACHE_FILE):
+    add_cached_offset(HEADER_ROW_CACHE.setdefault(source, {}), layout, header_row)
+
+    # Merge with the file content, parallel workers may have saved other layouts in the meantime
+    cache = {}
+    if os.path.exists(cache_file):
+        try:
+            with open(cache_file, 'r') as f:
+                cache = json.load(f)
+        except (OSError, json.JSONDecodeError):
+            cache = {}
+    add_cached_offset(cache.setdefault(source, {}), layout, header_row)
+
+    os.makedirs(os.path.dirname(cache_file), exist_ok=True)
+    temp_file = f'{cache_file}.{os.getpid()}.tmp'
+    with open(temp_file, 'w') as f:
+        json.dump(cache, f, indent=4)
+    os.replace(temp_file, cache_file)
+
+def get_header_fingerprint(row):
+    values = [str(value).strip().lower() if value is not None else '' for value in row]
+    while values and values[-1] == '':
+        values.pop()
+    return hashlib.sha256('|'.join(values).encode()).hexdigest()[:16]
+
+def get_layout_key(path, sheet, header):
+    extension = os.path.splitext(path)[1].lower().lstrip('.')
+    return f'{extension}|{sheet}|{get_header_fingerprint(header)}'
+
+def is_header_row(row, expected_headers):
+    values = {str(value).strip().lower() for value in row if value is not None}
+    return expected_headers.issubset(values)
+
+def locate_header_row(path, source, expected_headers, sheet_name=0, default=0):
+    """
+    Return the row number (0-indexed) of the header row in the raw file, to be used as iter_raw_file(header=...).
+
+    Every cached offset of the layouts already seen for the sheet is checked first (the row must match the expected
+    headers and the cached header fingerprint), the first HEADER_SCAN_ROWS rows are only scanned when the file has
+    a new layout or a preamble length not seen yet. Returns default when no row matches,
+    so the loader fails with the usual "Column schema has changed" message.
+
+    Parameters:
+    source : name of the export, for example 'sp_pay_wallet'
+    expected_headers : column headers (lowercase) that must all be in the header row
+    sheet_name : same as iter_raw_file, the layout uses the name of the sheet that is actually read
+    default : header row used when the header is not found
+    """
+    expected_headers = {header.lower() for header in expected_headers}
+    extension = os.path.splitext(path)[1].lower().lstrip('.')
+    cached_layouts = {layout: get_cached_offsets(value) for layout, value in load_header_cache().get(source, {}).items()
+                      if layout.startswith(f'{extension}|')}
+
+    try:
+        # Known layouts : only read up to the last cached header row
+        if cached_layouts:
+            sheet, rows = read_raw_head_sheet(path, sheet_name=sheet_name, nrows=max(max(offsets) for offsets in cached_layouts.values()) + 1)
+            for layout, offsets in cached_layouts.items():
+                for cached_row in offsets:
+                    if (cached_row < len(rows) and is_header_row(rows[cached_row], expected_headers)
+                            and layout == get_layout_key(path, sheet, rows[cached_row])):
+                        return cached_row
+
+        sheet, rows = read_raw_head_sheet(path, sheet_name=sheet_name, nrows=HEADER_SCAN_ROWS)
+    except Exception as e:
+        print(f'\033[1;31m--Failed to scan the header row: {path}. Error: {str(e)}\033[0m')
+        return default
+
+    header_row = next((idx for idx, row in enumerate(rows) if is_header_row(row, expected_headers)), None)
+
+    if header_row is None:
+        print(f'\033[1;31m--Header row not found in the first {len(rows)} rows: {path}\033[0m')
+        return default
+
+    layout = get_layout_key(path, sheet, rows[header_row])
+    print(f'Header row of {source} ({layout}) detected at row {header_row}')
+    save_header_cache(source, layout, header_row)
+
+    return header_row
+
+# # Example Usage:
+# header = locate_header_row(path, 'sp_pay_wallet', ['tanggal transaksi', 'tipe transaksi'], default=17)
+# for df in iter_raw_file(path, header=header): ...
@@ -0,0 +1,78 @@
+import os
+import hashlib
+import pandas as pd
+
+from bi_function import BI_CACHE_PATH, get_file_hash, evict_cache_dir
+
+# PARSE CACHE
+# Parsed and cleaned raw files are stored as Parquet, keyed by file content + loader name + loader schema version + parse options.
+# Eviction is least recently used: a cache hit refreshes the file mtime, the oldest files are removed first.
+
+PARSE_CACHE_PATH = os.path.join(BI_CACHE_PATH, 'parse_cache')
+PARSE_CACHE_MAX_BYTES = int(os.getenv("BI_PARSE_CACHE_MAX_MB", 2048)) * 1024 * 1024
+
+def get_parse_cache_file(path, loader_name, schema_version, parse_kwargs=None):
+    parse_kwargs = sorted((parse_kwargs or {}).items())
+    cache_key = hashlib.sha256(f'{get_file_hash(path)}|{loader_name}|{schema_version}|{parse_kwargs}'.encode()).hexdigest()
+    return os.path.join(PARSE_CACHE_PATH, loader_name, f'{cache_key}.parquet')
+
+def read_parse_cache(cache_file):
+    if not os.path.exists(cache_file):
+        return None
+
+    try:
+        df = pd.read_parquet(cache_file)
+        os.utime(cache_file) # mark as recently used
+        return df
+    except Exception as e:
+        print(f'\033[1;31m--Failed to read the parse cache, the file will be parsed again: {cache_file}. Error: {str(e)}\033[0m')
+        try:
+            os.remove(cache_file)
+        except OSError:
+            pass
+        return None
+
+def write_parse_cache(df, cache_file):
+    os.makedirs(os.path.dirname(cache_file), exist_ok=True)
+
+    # Write to a temporary file first so parallel workers never read a half written cache file
+    temp_file = f'{cache_file}.{os.getpid()}.tmp'
+    try:
+        df.to_parquet(temp_file, index=False)
+        os.replace(temp_file, cache_file)
+    except Exception as e:
+        print(f'\033[1;31m--Failed to write the parse cache: {cache_file}. Error: {str(e)}\033[0m')
+        if os.path.exists(temp_file):
+            os.remove(temp_file)
+        return
+
+    evict_cache_dir(PARSE_CACHE_PATH, PARSE_CACHE_MAX_BYTES)
+
+def read_with_parse_cache(path, parse_function, loader_name, schema_version, use_cache=True, **parse_kwargs):
+    """
+    Return parse_function(path, **parse_kwargs), served from the Parquet parse cache when the same file content
+    has already been parsed by the same loader, schema version and parse_kwargs.
+
+    Parameters:
+    parse_function : function that takes the file path (and parse_kwargs) and returns the cleaned DataFrame,
+                     it must not depend on anything other than the file content and parse_kwargs
+    loader_name : name of the cache folder, for example 'sp_order_data'
+    schema_version : bump it in the loader whenever the parsing or cleaning logic changes
+    parse_kwargs : extra arguments for parse_function, they are part of the cache key
+    """
+    if not use_cache:
+        return parse_function(path, **parse_kwargs)
+
+    cache_file = get_parse_cache_file(path, loader_name, schema_version, parse_kwargs)
+
+    df = read_parse_cache(cache_file)
+    if df is not None:
+        return df
+
+    df = parse_function(path, **parse_kwargs)
+
+    # Failed files raise, a DataFrame without any column is kept out of the cache as well
+    if len(df.columns) > 0:
+        write_parse_cache(df, cache_file)
+
+    return df
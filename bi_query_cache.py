@@ -0,0 +1,122 @@
+import os
+import re
+import json
+import time
+import hashlib
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from google.api_core.exceptions import NotFound
+from bi_function import BI_CACHE_PATH, read_from_gbq, get_query_job_config, evict_cache_dir
+
+# QUERY RESULT CACHE
+# Query results are stored as Parquet, keyed by the normalized SQL + query parameters + read_mode.
+# Every entry saves the last modified time of the tables the query reads (found with a free dry run),
+# the entry is only used while none of these tables has changed and it is younger than the TTL.
+# Eviction is least recently used, same as the parse cache.
+
+QUERY_CACHE_PATH = os.path.join(BI_CACHE_PATH, 'query_cache')
+QUERY_CACHE_MAX_BYTES = int(os.getenv("BI_QUERY_CACHE_MAX_MB", 1024)) * 1024 * 1024
+QUERY_CACHE_TTL_HOURS = float(os.getenv("BI_QUERY_CACHE_TTL_HOURS", 24))
+
+REFERENCED_TABLES = {} # {cache_key : [table_id, ...]}, the dry run is only done once per query per process
+
+def normalize_sql(sql):
+    # Collapse the whitespace outside of the quoted strings and identifiers, so the indentation does not change the key
+    return re.sub(r"('(?:[^'\\]|\\.)*'|\"(?:[^\"\\]|\\.)*\"|`[^`]*`)|\s+", lambda m: m.group(1) or ' ', sql).strip()
+
+def get_query_cache_key(sql, read_mode='default', params=None):
+    params = sorted((name, list(value) if isinstance(value, (list, tuple)) else value) for name, value in (params or {}).items())
+    return hashlib.sha256(f'{normalize_sql(sql)}|{params}|{read_mode}'.encode()).hexdigest()
+
+def get_referenced_tables(client, sql, cache_key, params=None):
+    if cache_key not in REFERENCED_TABLES:
+        job = client.query(sql, job_config=get_query_job_config(params, dry_run=True, use_query_cache=False))
+        REFERENCED_TABLES[cache_key] = [f'{table.project}.{table.dataset_id}.{table.table_id}' for table in job.referenced_tables]
+
+    return REFERENCED_TABLES[cache_key]
+
+def get_tables_modified(client, table_ids):
+    tables_modified = {}
+    for table_id in table_ids:
+        try:
+            tables_modified[table_id] = client.get_table(table_id).modified.isoformat()
+        except NotFound:
+            tables_modified[table_id] = None
+    return tables_modified
+
+def read_query_cache(cache_file, tables_modified, ttl_hours):
+    if not os.path.exists(cache_file):
+        return None
+
+    try:
+        table = pq.read_table(cache_file)
+        metadata = table.schema.metadata or {}
+
+        if json.loads(metadata.get(b'tables_modified', b'{}')) != tables_modified:
+            return None
+        if time.time() - float(metadata.get(b'cached_at', b'0')) > ttl_hours * 3600:
+            return None
+
+        os.utime(cache_file) # mark as recently used
+        return table.to_pandas()
+
+    except Exception as e:
+        print(f'\033[1;31m--Failed to read the query cache, the query will be run again: {cache_file}. Error: {str(e)}\033[0m')
+        try:
+            os.remove(cache_file)
+        except OSError:
+            pass
+        return None
+
+def write_query_cache(df, cache_file, tables_modified):
+    os.makedirs(os.path.dirname(cache_file), exist_ok=True)
+
+    # Write to a temporary file first so parallel runs never read a half written cache file
+    temp_file = f'{cache_file}.{os.getpid()}.tmp'
+    try:
+        table = pa.Table.from_pandas(df, preserve_index=False)
+        table = table.replace_schema_metadata({**(table.schema.metadata or {}),
+                                               b'tables_modified': json.dumps(tables_modified).encode(),
+                                               b'cached_at': str(time.time()).encode()})
+        pq.write_table(table, temp_file)
+        os.replace(temp_file, cache_file)
+    except Exception as e:
+        print(f'\033[1;31m--Failed to write the query cache: {cache_file}. Error: {str(e)}\033[0m')
+        if os.path.exists(temp_file):
+            os.remove(temp_file)
+        return
+
+    evict_cache_dir(QUERY_CACHE_PATH, QUERY_CACHE_MAX_BYTES)
+
+def read_from_gbq_cached(client, sql, read_mode='default', params=None, ttl_hours=QUERY_CACHE_TTL_HOURS):
+    """
+    Same as read_from_gbq(client, sql, read_mode, params), served from the local query cache when the same query
+    was already run and the tables it reads have not been modified since.
+
+    Only for deterministic queries : a query using CURRENT_DATE(), RAND(), ... is only refreshed by the TTL.
+
+    Parameters:
+    ttl_hours : maximum age of a cached result, in hours
+    """
+    cache_key = get_query_cache_key(sql, read_mode, params)
+    cache_file = os.path.join(QUERY_CACHE_PATH, f'{cache_key}.parquet')
+
+    try:
+        tables_modified = get_tables_modified(client, get_referenced_tables(client, sql, cache_key, params))
+    except Exception as e:
+        print(f'\033[1;31m--Failed to check the tables of the query, reading without the query cache. Error: {str(e)}\033[0m')
+        return read_from_gbq(client, sql, read_mode, params)
+
+    df = read_query_cache(cache_file, tables_modified, ttl_hours)
+    if df is not None:
+        return df
+
+    df = read_from_gbq(client, sql, read_mode, params)
+    write_query_cache(df, cache_file, tables_modified)
+
+    return df
+
+# # Example Usage:
+# df = read_from_gbq_cached(BI_CLIENT, f"SELECT * FROM `{BI_PROJECT_ID}.report_rc.sp_pay_wallet` WHERE folder_id = @folder_id",
+#                           params={'folder_id': 'ABC_12345'})
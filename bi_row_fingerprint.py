@@ -0,0 +1,149 @@
+import os
+import hashlib
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from google.api_core.exceptions import NotFound
+from bi_function import BI_CACHE_PATH, BI_CLIENT, BI_PROJECT_ID, write_table_by_unique_id, delete_table_by_unique_id
+
+# ROW FINGERPRINT
+# Fingerprint of the rows last written to a target table, stored as Parquet : one row per unique id group
+# (unique_col_ref upper-cased + date of date_col_ref, same matching as write_table_by_unique_id) with the hash and row count of the group.
+# The fingerprint is only used while the table last modified time is the one saved after our own write,
+# so any other write to the table (or a new column) makes the next run a full write.
+
+FINGERPRINT_PATH = os.path.join(BI_CACHE_PATH, 'row_fingerprint')
+
+def get_fingerprint_file(target_table, unique_col_ref, date_col_ref=None):
+    key = hashlib.sha256(f'{target_table}|{unique_col_ref}|{date_col_ref}'.encode()).hexdigest()[:16]
+    return os.path.join(FINGERPRINT_PATH, f'{target_table}_{key}.parquet')
+
+def get_table_modified(target_table):
+    try:
+        return BI_CLIENT.get_table(f'{BI_PROJECT_ID}.{target_table}').modified.isoformat()
+    except NotFound:
+        return None
+
+def get_row_keys(df, unique_col_ref, date_col_ref=None):
+    # Key columns of every row, normalized the same way as the DELETE of write_table_by_unique_id, and their hash
+    keys = pd.DataFrame({col: df[col].astype(str).str.upper() for col in unique_col_ref}, index=df.index)
+    if date_col_ref:
+        keys[date_col_ref] = pd.to_datetime(df[date_col_ref]).dt.normalize()
+
+    keys['_key_hash'] = pd.util.hash_pandas_object(keys, index=False)
+    return keys
+
+def get_row_fingerprint(df, keys):
+    """
+    Return one row per unique id group of df : the key columns, _key_hash, _row_hash (sum of the row hashes,
+    so the row order does not matter) and _row_count.
+
+    Parameters:
+    keys : get_row_keys(df, ...)
+    """
+    fingerprint = keys.assign(_row_hash=pd.util.hash_pandas_object(df, index=False), _row_count=1) # categorical and object columns give the same hash
+    key_columns = [col for col in keys.columns if col != '_key_hash']
+
+    return fingerprint.groupby('_key_hash', sort=False).agg(
+        {**{col: 'first' for col in key_columns}, '_row_hash': 'sum', '_row_count': 'sum'}).reset_index()
+
+def read_fingerprint(fingerprint_file, table_modified, columns):
+    # Returns None when there is no fingerprint or it can not be trusted anymore
+    if table_modified is None or not os.path.exists(fingerprint_file):
+        return None
+
+    try:
+        table = pq.read_table(fingerprint_file)
+    except Exception as e:
+        print(f'\033[1;31m--Failed to read the row fingerprint, the table will be fully written: {fingerprint_file}. Error: {str(e)}\033[0m')
+        return None
+
+    metadata = table.schema.metadata or {}
+    if metadata.get(b'table_modified', b'').decode() != table_modified or metadata.get(b'columns', b'').decode() != '|'.join(columns):
+        return None
+
+    return table.to_pandas()
+
+def write_fingerprint(fingerprint, fingerprint_file, table_modified, columns):
+    if table_modified is None:
+        return
+
+    os.makedirs(os.path.dirname(fingerprint_file), exist_ok=True)
+
+    table = pa.Table.from_pandas(fingerprint, preserve_index=False)
+    table = table.replace_schema_metadata({**(table.schema.metadata or {}),
+                                           b'table_modified': table_modified.encode(), b'columns': '|'.join(columns).encode()})
+
+    # Write to a temporary file first so an interrupted run never leaves a half written fingerprint
+    temp_file = f'{fingerprint_file}.{os.getpid()}.tmp'
+    try:
+        pq.write_table(table, temp_file)
+        os.replace(temp_file, fingerprint_file)
+    except Exception as e:
+        print(f'\033[1;31m--Failed to write the row fingerprint: {fingerprint_file}. Error: {str(e)}\033[0m')
+        if os.path.exists(temp_file):
+            os.remove(temp_file)
+
+def write_table_by_row_diff(df, target_table, write_method, unique_col_ref, date_col_ref=None):
+
+    """
+    Same result as write_table_by_unique_id, but only the unique id groups that were inserted, changed or removed
+    since the last write are uploaded or deleted. The other groups are byte-identical to the table and are skipped.
+
+    - write_method = 'replace' : the changed groups are written with append, the groups that are not in df anymore are deleted
+    - write_method = 'append' / 'upsert' : the changed groups are written with the same write_method
+
+    The first run, and every run after the table was written by something else, is a full write_table_by_unique_id.
+
+    Parameters:
+    same as write_table_by_unique_id
+    """
+
+    if write_method not in ('replace', 'append', 'upsert'):
+        print(f'\033[1;31mThe options for the write_table method are "replace", "append" or "upsert". Please choose the correct one.\033[0m')
+        return
+
+    columns = list(df.columns)
+    fingerprint_file = get_fingerprint_file(target_table, unique_col_ref, date_col_ref)
+    keys = get_row_keys(df, unique_col_ref, date_col_ref)
+    fingerprint = get_row_fingerprint(df, keys)
+    previous = read_fingerprint(fingerprint_file, get_table_modified(target_table), columns)
+
+    if previous is None:
+        print(f'No valid row fingerprint for {target_table}, writing all rows')
+        write_table_by_unique_id(df, target_table, write_method, unique_col_ref, date_col_ref)
+        write_fingerprint(fingerprint, fingerprint_file, get_table_modified(target_table), columns)
+        return
+
+    # Compare Fingerprint
+    merged = fingerprint.merge(previous[['_key_hash', '_row_hash', '_row_count']], on='_key_hash', how='left', suffixes=('', '_previous'))
+    changed_keys = merged.loc[(merged['_row_hash'] != merged['_row_hash_previous']) | (merged['_row_count'] != merged['_row_count_previous']), '_key_hash']
+    removed = previous[~previous['_key_hash'].isin(fingerprint['_key_hash'])] if write_method == 'replace' else previous.iloc[0:0]
+
+    print(f'Row fingerprint - {target_table} : {len(changed_keys)} changed, {len(fingerprint) - len(changed_keys)} unchanged, {len(removed)} removed id')
+
+    if len(changed_keys) == 0 and len(removed) == 0:
+        print(f'No changed rows to upload - {target_table}')
+        return
+
+    if len(removed) > 0:
+        delete_table_by_unique_id(removed, target_table, unique_col_ref, date_col_ref)
+
+    if len(changed_keys) > 0:
+        df_changed = df[keys['_key_hash'].isin(changed_keys).values]
+        write_table_by_unique_id(df_changed, target_table, 'append' if write_method == 'replace' else write_method, unique_col_ref, date_col_ref)
+
+    # Groups written before and not in df are still in the table with append / upsert
+    if write_method != 'replace':
+        fingerprint = pd.concat([previous[~previous['_key_hash'].isin(fingerprint['_key_hash'])], fingerprint], ignore_index=True)
+
+    write_fingerprint(fingerprint, fingerprint_file, get_table_modified(target_table), columns)
+
+# # Example Usage:
+# write_table_by_row_diff(df,
+#                         target_table = 'report_rc.sp_order_data',
+#                         write_method='replace',
+#                         unique_col_ref = ['folder_id','order_number'],
+#                         date_col_ref = 'order_creation_time'
+#                         )
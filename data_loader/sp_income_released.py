@@ -5,138 +5,115 @@ import sys,os
 sys.path.insert(0, os.getenv("PROJECT_PATH"))
 
 from bi_function import *
+from bi_file_manifest import select_files_to_load, record_loaded_files
+from bi_parse_cache import read_with_parse_cache
+from bi_row_fingerprint import write_table_by_row_diff
+from bi_header_locator import locate_header_row
+from data_loader.sp_schema import sp_income_schema, apply_schema, get_schema_usecols, get_schema_headers, get_number_format
 
-def sp_income_released(count_file,target_table,db_method,data_path,store_dim):
+SCHEMA_VERSION = 3 # bump this when parse_table output changes, so the parse cache is refreshed
+
+def get_income_sheets(sheet_names):
+    # Every 'Income', 'Income - 1', 'Income - 2', ... sheet, in numeric order
+    def income_sheet_order(sheet_name):
+        suffix = sheet_name.replace('Income', '').replace('-', '').strip()
+        return int(suffix) if suffix else 0
+
+    return sorted([sheet_name for sheet_name in sheet_names if re.fullmatch(r'Income( - \d+)?', sheet_name)],
+                  key=income_sheet_order)
+
+def clean_table(df, path, required_only=False, number_format=('.', ',')):
+
+    df = apply_schema(df, sp_income_schema, path, required_only, number_format, loader='sp_income_released')
+
+    # Map Month
+
+    df.insert(0, 'month_income', df['fund_release_date'].dt.strftime('%Y%m'))
+    df.insert(1, 'month_order', df['order_creation_time'].dt.strftime('%Y%m'))
+
+    return df
+
+def parse_table(path, chunk_size=None, required_only=False, number_format=('.', ',')):
+
+    # The workbook is opened once and every Income sheet is read from it.
+    # With chunk_size, the sheets are streamed and cleaned chunk by chunk, so only the cleaned columns are kept in memory
+    df_list = []
+    usecols = get_schema_usecols(sp_income_schema, required_only) # only the schema columns are parsed
+    header = locate_header_row(path, 'sp_income_released', get_schema_headers(sp_income_schema), sheet_name=get_income_sheets, default=5) # the preamble length can change
+
+    for df in iter_raw_file(path, sheet_name=get_income_sheets, header=header, chunk_size=chunk_size, usecols=usecols):
+        df_list.append(clean_table(df, path, required_only, number_format))
+
+    if not df_list:
+        raise ValueError(f'Failed to read any valid sheets in file: {path}')
+
+    return pd.concat(df_list, ignore_index=True)
+
+def read_table(path, store_dim, use_cache=False, chunk_size=None, required_only=False):
+
+    uq_id = Path(path).parts[-2]
+    number_format = get_number_format(store_dim[uq_id][1])
+
+    df = read_with_parse_cache(path, parse_table, 'sp_income_released', SCHEMA_VERSION, use_cache,
+                               chunk_size=chunk_size, required_only=required_only, number_format=number_format)
+
+    # Map Dimension
+
+    insert_store_dim(df, store_dim, uq_id, loc=2) # categorical store_id, country, currency, platform, store, folder_id
+
+    return df
+
+def sp_income_released(count_file,target_table,db_method,data_path,store_dim,max_workers=1,incremental=False,use_cache=False,chunk_size=None,required_only=False,row_budget=None,diff_only=False):
+
+    # diff_only compares the full data with the fingerprint of the last write, the batches of row_budget are written one by one
+    if diff_only and row_budget:
+        raise ValueError('diff_only can not be used with row_budget, choose one of them')
 
     file_path = get_latest_file_multiple_folder([os.path.join(os.getenv("BASE_RAW_FILE_PATH", ""), folder) for folder in data_path],n=count_file)
 
     print(f'count_file = {count_file}')
     print(f'actual file = {len(file_path)}')
 
-    def read_table(path):
-
-        possible_sheet_names = ['Income','Income - 1','Income - 2','Income - 3','Income - 4','Income - 5',
-                                'Income - 6','Income - 7','Income - 8','Income - 9','Income - 10']
-        data_frames = []
-
-        for sheet_name in possible_sheet_names:
-            try:
-                data = pd.read_excel(path, sheet_name=sheet_name, header=5, dtype=str)
-                data_frames.append(data)
-            except Exception:
-                pass
-
-        if not data_frames:
-            print(f"\033[1;31m--Failed to read any valid sheets in file: {path}\033[0m")
-            return pd.DataFrame()
-        
-        df = pd.concat(data_frames, ignore_index=True)
-        
-        column_mapping = {
-        'no.': 'index',
-        'no. pesanan': 'order_number',
-        'no. pengajuan': 'submission_number',
-        'username (pembeli)': 'buyer_username',
-        'waktu pesanan dibuat': 'order_creation_time',
-        'metode pembayaran pembeli': 'buyer_payment_method',
-        'tanggal dana dilepaskan': 'fund_release_date',
-        'harga asli produk': 'original_product_price',
-        'total diskon produk': 'total_product_discount',
-        'jumlah pengembalian dana ke pembeli': 'buyer_refund_amount',
-        'diskon produk dari shopee': 'shopee_product_discount',
-        'diskon voucher ditanggung penjual': 'seller_borne_voucher_discount',
-        'cashback koin yang ditanggung penjual': 'seller_borne_cashback_coins',
-        'ongkir dibayar pembeli': 'shipping_paid_by_buyer',
-        'diskon ongkir ditanggung jasa kirim': 'shipping_discount_borne_by_courier',
-        'gratis ongkir dari shopee': 'shopee_free_shipping',
-        'ongkir yang diteruskan oleh shopee ke jasa kirim': 'shipping_fees_forwarded_to_courier',
-        'ongkos kirim pengembalian barang': 'return_shipping_cost',
-        'pengembalian biaya kirim': 'shipping_fee_refund',
-        'biaya komisi ams': 'ams_commission_fee',
-        'biaya administrasi': 'administration_fee',
-        'biaya layanan (termasuk ppn 11%)': 'service_fee_incl_vat_11_percent',
-        'premi': 'premium_fee',
-        'biaya program': 'program_fee',
-        'biaya kartu kredit': 'credit_card_fee',
-        'biaya kampanye': 'campaign_fee',
-        'bea masuk, ppn & pph': 'import_vat_income_tax',
-        'total penghasilan': 'total_income',
-        'kode voucher': 'voucher_code',
-        'kompensasi': 'compensation',
-        'promo gratis ongkir dari penjual': 'seller_free_shipping_promo',
-        'jasa kirim': 'courier_service',
-        'nama kurir': 'courier_name',
-        'unnamed: 33': 'unnamed_column_33',
-        'pengembalian dana ke pembeli': 'refund_to_buyer',
-        'pro-rata koin yang ditukarkan untuk pengembalian barang': 'pro_rata_coin_refund_for_return',
-        'pro-rata voucher shopee untuk pengembalian barang': 'pro_rata_shopee_voucher_for_return',
-        'pro-rated bank payment channel promotion  for return refund items': 'pro_rated_bank_promo_for_return',
-        'pro-rated shopee payment channel promotion  for return refund items': 'pro_rated_shopee_promo_for_return'
-    }
-        
-        default_col = ['index','order_number','submission_number','buyer_username','order_creation_time',
-                    'buyer_payment_method','fund_release_date','original_product_price','total_product_discount',
-                    'buyer_refund_amount','shopee_product_discount','seller_borne_voucher_discount',
-                    'seller_borne_cashback_coins','shipping_paid_by_buyer','shipping_discount_borne_by_courier',
-                    'shopee_free_shipping','shipping_fees_forwarded_to_courier','return_shipping_cost',
-                    'shipping_fee_refund','ams_commission_fee','administration_fee','service_fee_incl_vat_11_percent',
-                    'premium_fee','program_fee','credit_card_fee','campaign_fee','import_vat_income_tax',
-                    'total_income','voucher_code','compensation','seller_free_shipping_promo','courier_service',
-                    'courier_name','unnamed_column_33','refund_to_buyer','pro_rata_coin_refund_for_return',
-                    'pro_rata_shopee_voucher_for_return','pro_rated_bank_promo_for_return','pro_rated_shopee_promo_for_return']
-
-
-        df.columns = [column_mapping.get(col.lower(), col) for col in df.columns]
-
-        try:
-            df = df[default_col]
-        except Exception as e:
-            print(f'\033[1;31m--Column schema has changed: {path}. Error: {str(e)}\033[0m')
-            return pd.DataFrame()
-
-        # Clean Data Type
-
-        try:
-
-            for d in ['order_creation_time','fund_release_date']:
-                df[d] = pd.to_datetime(df[d], errors='coerce')
-
-            for f in ['original_product_price','total_product_discount',
-                    'buyer_refund_amount','shopee_product_discount','seller_borne_voucher_discount',
-                    'seller_borne_cashback_coins','shipping_paid_by_buyer','shipping_discount_borne_by_courier',
-                    'shopee_free_shipping','shipping_fees_forwarded_to_courier','return_shipping_cost',
-                    'shipping_fee_refund','ams_commission_fee','administration_fee','service_fee_incl_vat_11_percent',
-                    'premium_fee','program_fee','credit_card_fee','campaign_fee','import_vat_income_tax',
-                    'total_income','compensation','seller_free_shipping_promo','refund_to_buyer','pro_rata_coin_refund_for_return',
-                    'pro_rata_shopee_voucher_for_return','pro_rated_bank_promo_for_return','pro_rated_shopee_promo_for_return']:
-                df[f] = df[f].str.replace('.','')
-                df[f] = df[f].astype(float)
-
-        except Exception as e:
-            print(f'\033[1;31m--There is some issue when cleaning the data type: {path}. Error: {str(e)}\033[0m')
-            return pd.DataFrame()
-        
-        # Map Dimension
-
-        df.insert(0, 'month_income', df['fund_release_date'].dt.strftime('%Y%m'))
-        df.insert(1, 'month_order', df['order_creation_time'].dt.strftime('%Y%m'))
-
-        uq_id = Path(path).parts[-2]
-
-        df.insert(2, 'store_id', store_dim[uq_id][0])
-        df.insert(3, 'country', store_dim[uq_id][1])
-        df.insert(4, 'currency', store_dim[uq_id][2])
-        df.insert(5, 'platform', store_dim[uq_id][3])
-        df.insert(6, 'store', store_dim[uq_id][4])
-        df.insert(7, 'folder_id', uq_id)
-
-        return df
-        
-    df = pd.concat([read_table(path) for path in file_path], ignore_index=True)
-    
-    write_table_by_unique_id(df,
-                            target_table = target_table,
-                            write_method=db_method,
-                            unique_col_ref = ['folder_id','order_number'],
-                            date_col_ref = 'fund_release_date'
-                            )
\ No newline at end of file
+    if incremental:
+        file_path, file_info = select_files_to_load(file_path, target_table, db_method)
+        print(f'new or changed file = {len(file_path)}')
+
+        if not file_path:
+            print(f'No new or changed file to load for {target_table}')
+            record_loaded_files(file_info, file_path, [], target_table, db_method)
+            return
+
+    if row_budget:
+        # Batched mode : the parsed files are uploaded in batches of about row_budget rows,
+        # so the memory used does not grow with the number of files
+        df_list = [] # zero-row DataFrame of every file, for the ingestion manifest
+        read_errors = {} # filled while the batches are read
+        df_batches = read_files_in_batches(read_table, file_path, row_budget, df_list, max_workers=max_workers, read_errors=read_errors, store_dim=store_dim,
+                                           use_cache=use_cache, chunk_size=chunk_size, required_only=required_only)
+
+        write_table_by_unique_id_batched(df_batches,
+                                        target_table = target_table,
+                                        write_method=db_method,
+                                        unique_col_ref = ['folder_id','order_number'],
+                                        date_col_ref = 'fund_release_date'
+                                        )
+    else:
+        df_list, read_errors = read_files_parallel(read_table, file_path, max_workers=max_workers, store_dim=store_dim,
+                                                   use_cache=use_cache, chunk_size=chunk_size, required_only=required_only)
+
+        df = pd.concat(df_list, ignore_index=True)
+
+        # diff_only : only the rows that changed since the last load are uploaded, see write_table_by_row_diff
+        write_function = write_table_by_row_diff if diff_only else write_table_by_unique_id
+
+        write_function(df,
+                                target_table = target_table,
+                                write_method=db_method,
+                                unique_col_ref = ['folder_id','order_number'],
+                                date_col_ref = 'fund_release_date'
+                                )
+
+    if incremental:
+        record_loaded_files(file_info, file_path, df_list, target_table, db_method)
+
+    raise_read_errors(read_errors, target_table) # the failed files are not in the manifest, the next incremental run reads them again
\ No newline at end of file
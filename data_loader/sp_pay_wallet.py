@@ -5,78 +5,101 @@ import sys,os
 sys.path.insert(0, os.getenv("PROJECT_PATH"))
 
 from bi_function import *
+from bi_file_manifest import select_files_to_load, record_loaded_files
+from bi_parse_cache import read_with_parse_cache
+from bi_row_fingerprint import write_table_by_row_diff
+from bi_header_locator import locate_header_row
+from data_loader.sp_schema import sp_wallet_schema, apply_schema, get_schema_usecols, get_schema_headers, get_number_format
 
-def sp_pay_wallet(count_file,target_table,db_method,data_path,store_dim):
+SCHEMA_VERSION = 2 # bump this when parse_table output changes, so the parse cache is refreshed
+
+def clean_table(df, path, required_only=False, number_format=('.', ',')):
+
+    df = apply_schema(df, sp_wallet_schema, path, required_only, number_format, loader='sp_pay_wallet')
+
+    # Map Month
+
+    df.insert(0, 'month_wallet', df['transaction_date'].dt.strftime('%Y%m'))
+
+    return df
+
+def parse_table(path, chunk_size=None, required_only=False, number_format=('.', ',')):
+
+    # With chunk_size, the file is streamed and cleaned chunk by chunk, so only the cleaned columns are kept in memory
+    df_list = []
+    usecols = get_schema_usecols(sp_wallet_schema, required_only) # only the schema columns are parsed
+    header = locate_header_row(path, 'sp_pay_wallet', get_schema_headers(sp_wallet_schema), default=17) # the preamble length can change
+
+    for df in iter_raw_file(path, header=header, chunk_size=chunk_size, usecols=usecols):
+        df_list.append(clean_table(df, path, required_only, number_format))
+
+    return pd.concat(df_list, ignore_index=True)
+
+def read_table(path, store_dim, use_cache=False, chunk_size=None, required_only=False):
+
+    uq_id = Path(path).parts[-2]
+    number_format = get_number_format(store_dim[uq_id][1])
+
+    df = read_with_parse_cache(path, parse_table, 'sp_pay_wallet', SCHEMA_VERSION, use_cache,
+                               chunk_size=chunk_size, required_only=required_only, number_format=number_format)
+
+    # Map Dimension
+
+    insert_store_dim(df, store_dim, uq_id, loc=1) # categorical store_id, country, currency, platform, store, folder_id
+
+    return df
+
+def sp_pay_wallet(count_file,target_table,db_method,data_path,store_dim,max_workers=1,incremental=False,use_cache=False,chunk_size=None,required_only=False,row_budget=None,diff_only=False):
+
+    # diff_only compares the full data with the fingerprint of the last write, the batches of row_budget are written one by one
+    if diff_only and row_budget:
+        raise ValueError('diff_only can not be used with row_budget, choose one of them')
 
     file_path = get_latest_file_multiple_folder([os.path.join(os.getenv("BASE_RAW_FILE_PATH", ""), folder) for folder in data_path],n=count_file)
 
     print(f'count_file = {count_file}')
     print(f'actual file = {len(file_path)}')
 
-    def read_table(path):
-
-        try:
-            df = pd.read_excel(path,header=17,dtype=str)
-        except Exception as e:
-            print(f'\033[1;31m--Failed to read the file: {path}. Error: {str(e)}\033[0m')
-            return pd.DataFrame()
-        
-        column_mapping = {
-            'tanggal transaksi': 'transaction_date',
-            'tipe transaksi': 'transaction_type',
-            'deskripsi': 'description',
-            'no. pesanan': 'order_number',
-            'jenis transaksi': 'transaction_category',
-            'jumlah': 'amount',
-            'status': 'status',
-            'saldo akhir': 'ending_balance'
-        }
-
-        default_col = ['transaction_date', 'transaction_type', 'description',  'order_number', 'transaction_category',
-                       'amount', 'status', 'ending_balance']
-
-        df.columns = [column_mapping.get(col.lower(), col) for col in df.columns]
-
-        try:
-            df = df[default_col]
-        except Exception as e:
-            print(f'\033[1;31m--Column schema has changed: {path}. Error: {str(e)}\033[0m')
-            return pd.DataFrame()
-
-        # Clean Data Type
-
-        try:
-
-            for d in ['transaction_date']:
-                df[d] = pd.to_datetime(df[d], errors='coerce')
-
-            for f in ['amount','ending_balance']:
-                df[f] = df[f].astype(float)
-
-        except Exception as e:
-            print(f'\033[1;31m--There is some issue when cleaning the data type: {path}. Error: {str(e)}\033[0m')
-            return pd.DataFrame()
-        
-        # Map Dimension
-
-        df.insert(0, 'month_wallet', df['transaction_date'].dt.strftime('%Y%m'))
-
-        uq_id = Path(path).parts[-2]
-
-        df.insert(1, 'store_id', store_dim[uq_id][0])
-        df.insert(2, 'country', store_dim[uq_id][1])
-        df.insert(3, 'currency', store_dim[uq_id][2])
-        df.insert(4, 'platform', store_dim[uq_id][3])
-        df.insert(5, 'store', store_dim[uq_id][4])
-        df.insert(6, 'folder_id', uq_id)
-        
-        return df
-
-    df = pd.concat([read_table(path) for path in file_path], ignore_index=True)
-    
-    write_table_by_unique_id(df,
-                            target_table = target_table,
-                            write_method=db_method,
-                            unique_col_ref = ['folder_id','transaction_type','description','order_number','transaction_category'], # need to be optimized, still have duplicate with this combination when append
-                            date_col_ref = 'transaction_date'
-                            )
\ No newline at end of file
+    if incremental:
+        file_path, file_info = select_files_to_load(file_path, target_table, db_method)
+        print(f'new or changed file = {len(file_path)}')
+
+        if not file_path:
+            print(f'No new or changed file to load for {target_table}')
+            record_loaded_files(file_info, file_path, [], target_table, db_method)
+            return
+
+    if row_budget:
+        # Batched mode : the parsed files are uploaded in batches of about row_budget rows,
+        # so the memory used does not grow with the number of files
+        df_list = [] # zero-row DataFrame of every file, for the ingestion manifest
+        read_errors = {} # filled while the batches are read
+        df_batches = read_files_in_batches(read_table, file_path, row_budget, df_list, max_workers=max_workers, read_errors=read_errors, store_dim=store_dim,
+                                           use_cache=use_cache, chunk_size=chunk_size, required_only=required_only)
+
+        write_table_by_unique_id_batched(df_batches,
+                                        target_table = target_table,
+                                        write_method=db_method,
+                                        unique_col_ref = ['folder_id','transaction_type','description','order_number','transaction_category'], # need to be optimized, still have duplicate with this combination when append
+                                        date_col_ref = 'transaction_date'
+                                        )
+    else:
+        df_list, read_errors = read_files_parallel(read_table, file_path, max_workers=max_workers, store_dim=store_dim,
+                                                   use_cache=use_cache, chunk_size=chunk_size, required_only=required_only)
+
+        df = pd.concat(df_list, ignore_index=True)
+
+        # diff_only : only the rows that changed since the last load are uploaded, see write_table_by_row_diff
+        write_function = write_table_by_row_diff if diff_only else write_table_by_unique_id
+
+        write_function(df,
+                                target_table = target_table,
+                                write_method=db_method,
+                                unique_col_ref = ['folder_id','transaction_type','description','order_number','transaction_category'], # need to be optimized, still have duplicate with this combination when append
+                                date_col_ref = 'transaction_date'
+                                )
+
+    if incremental:
+        record_loaded_files(file_info, file_path, df_list, target_table, db_method)
+
+    raise_read_errors(read_errors, target_table) # the failed files are not in the manifest, the next incremental run reads them again
\ No newline at end of file
@@ -0,0 +1,202 @@
+import pandas as pd
+
+from bi_function import coerce_number_columns, coerce_datetime_columns
+
+# SHOPEE RAW FILE SCHEMA
+# format : {column_name : (column header in the raw file (lowercase), dtype, required)}
+# dtype : 'str', 'datetime', 'int', 'float', 'money' (number formatted by store country, see sp_country_number_format)
+# required : True  -> the file is skipped ("Column schema has changed") when the column does not exist
+#            False -> filled with null when the column does not exist,
+#                     and not read at all when the loader runs with required_only=True
+# The column order of the loaded table follows the order of the dictionary.
+# Columns in the raw file that are not listed here are never parsed.
+
+# Number format of the 'money' columns by store country (see RC_SHOPEE_STORE_INFO) : (thousand separator, decimal separator)
+sp_country_number_format = {
+    'ID': ('.', ','),
+    'VN': ('.', ','),
+    'SG': (',', '.'),
+    'MY': (',', '.'),
+    'TH': (',', '.'),
+    'PH': (',', '.'),
+}
+
+def get_number_format(country):
+    return sp_country_number_format.get(country, sp_country_number_format['ID'])
+
+# Only the columns that are not in every country / export version are optional :
+# pick-up counter, returned quantity, bundle deal (paket diskon), coin / credit card / shipping deductions and the address region.
+sp_order_schema = {
+    'order_number': ('no. pesanan', 'str', True),
+    'order_status': ('status pesanan', 'str', True),
+    'cancellation_reason': ('alasan pembatalan', 'str', True),
+    'cancellation_return_status': ('status pembatalan/ pengembalian', 'str', True),
+    'tracking_number': ('no. resi', 'str', True),
+    'shipping_option': ('opsi pengiriman', 'str', True),
+    'counter_pickup_option': ('antar ke counter/ pick-up', 'str', False),
+    'order_delivery_deadline': ('pesanan harus dikirimkan sebelum (menghindari keterlambatan)', 'datetime', True),
+    'scheduled_delivery_time': ('waktu pengiriman diatur', 'datetime', True),
+    'order_creation_time': ('waktu pesanan dibuat', 'datetime', True),
+    'payment_time': ('waktu pembayaran dilakukan', 'datetime', True),
+    'payment_method': ('metode pembayaran', 'str', True),
+    'parent_sku': ('sku induk', 'str', True),
+    'product_name': ('nama produk', 'str', True),
+    'sku_reference_number': ('nomor referensi sku', 'str', True),
+    'variant_name': ('nama variasi', 'str', True),
+    'initial_price': ('harga awal', 'money', True),
+    'price_after_discount': ('harga setelah diskon', 'money', True),
+    'quantity': ('jumlah', 'int', True),
+    'returned_quantity': ('returned quantity', 'int', False),
+    'total_product_price': ('total harga produk', 'money', True),
+    'total_discount': ('total diskon', 'money', True),
+    'seller_discount': ('diskon dari penjual', 'money', True),
+    'shopee_discount': ('diskon dari shopee', 'money', True),
+    'product_weight': ('berat produk', 'str', True),
+    'ordered_product_quantity': ('jumlah produk di pesan', 'int', True),
+    'total_weight': ('total berat', 'str', True),
+    'seller_borne_voucher': ('voucher ditanggung penjual', 'money', True),
+    'coin_cashback': ('cashback koin', 'money', True),
+    'shopee_borne_voucher': ('voucher ditanggung shopee', 'money', True),
+    'discount_package': ('paket diskon', 'str', False),
+    'shopee_discount_package': ('paket diskon (diskon dari shopee)', 'money', False),
+    'seller_discount_package': ('paket diskon (diskon dari penjual)', 'money', False),
+    'shopee_coin_deduction': ('potongan koin shopee', 'money', False),
+    'credit_card_discount': ('diskon kartu kredit', 'money', False),
+    'buyer_paid_shipping_cost': ('ongkos kirim dibayar oleh pembeli', 'money', True),
+    'estimated_shipping_deduction': ('estimasi potongan biaya pengiriman', 'money', False),
+    'return_shipping_cost': ('ongkos kirim pengembalian barang', 'money', True),
+    'total_payment': ('total pembayaran', 'money', True),
+    'estimated_shipping_cost': ('perkiraan ongkos kirim', 'money', True),
+    'buyer_note': ('catatan dari pembeli', 'str', True),
+    'note': ('catatan', 'str', True),
+    'buyer_username': ('username (pembeli)', 'str', True),
+    'recipient_name': ('nama penerima', 'str', True),
+    'phone_number': ('no. telepon', 'str', True),
+    'shipping_address': ('alamat pengiriman', 'str', True),
+    'city_district': ('kota/kabupaten', 'str', False),
+    'province': ('provinsi', 'str', False),
+    'order_completion_time': ('waktu pesanan selesai', 'datetime', True)
+}
+
+sp_income_schema = {
+    'index': ('no.', 'str', True),
+    'order_number': ('no. pesanan', 'str', True),
+    'submission_number': ('no. pengajuan', 'str', True),
+    'buyer_username': ('username (pembeli)', 'str', True),
+    'order_creation_time': ('waktu pesanan dibuat', 'datetime', True),
+    'buyer_payment_method': ('metode pembayaran pembeli', 'str', True),
+    'fund_release_date': ('tanggal dana dilepaskan', 'datetime', True),
+    'original_product_price': ('harga asli produk', 'money', True),
+    'total_product_discount': ('total diskon produk', 'money', True),
+    'buyer_refund_amount': ('jumlah pengembalian dana ke pembeli', 'money', True),
+    'shopee_product_discount': ('diskon produk dari shopee', 'money', True),
+    'seller_borne_voucher_discount': ('diskon voucher ditanggung penjual', 'money', True),
+    'seller_borne_cashback_coins': ('cashback koin yang ditanggung penjual', 'money', True),
+    'shipping_paid_by_buyer': ('ongkir dibayar pembeli', 'money', True),
+    'shipping_discount_borne_by_courier': ('diskon ongkir ditanggung jasa kirim', 'money', True),
+    'shopee_free_shipping': ('gratis ongkir dari shopee', 'money', True),
+    'shipping_fees_forwarded_to_courier': ('ongkir yang diteruskan oleh shopee ke jasa kirim', 'money', True),
+    'return_shipping_cost': ('ongkos kirim pengembalian barang', 'money', True),
+    'shipping_fee_refund': ('pengembalian biaya kirim', 'money', True),
+    'ams_commission_fee': ('biaya komisi ams', 'money', True),
+    'administration_fee': ('biaya administrasi', 'money', True),
+    'service_fee_incl_vat_11_percent': ('biaya layanan (termasuk ppn 11%)', 'money', True),
+    'premium_fee': ('premi', 'money', True),
+    'program_fee': ('biaya program', 'money', True),
+    'credit_card_fee': ('biaya kartu kredit', 'money', True),
+    'campaign_fee': ('biaya kampanye', 'money', True),
+    'import_vat_income_tax': ('bea masuk, ppn & pph', 'money', True),
+    'total_income': ('total penghasilan', 'money', True),
+    'voucher_code': ('kode voucher', 'str', True),
+    'compensation': ('kompensasi', 'money', True),
+    'seller_free_shipping_promo': ('promo gratis ongkir dari penjual', 'money', True),
+    'courier_service': ('jasa kirim', 'str', True),
+    'courier_name': ('nama kurir', 'str', True),
+    'unnamed_column_33': ('unnamed: 33', 'str', True),
+    'refund_to_buyer': ('pengembalian dana ke pembeli', 'money', True),
+    'pro_rata_coin_refund_for_return': ('pro-rata koin yang ditukarkan untuk pengembalian barang', 'money', True),
+    'pro_rata_shopee_voucher_for_return': ('pro-rata voucher shopee untuk pengembalian barang', 'money', True),
+    'pro_rated_bank_promo_for_return': ('pro-rated bank payment channel promotion  for return refund items', 'money', True),
+    'pro_rated_shopee_promo_for_return': ('pro-rated shopee payment channel promotion  for return refund items', 'money', True)
+}
+
+sp_wallet_schema = {
+    'transaction_date': ('tanggal transaksi', 'datetime', True),
+    'transaction_type': ('tipe transaksi', 'str', True),
+    'description': ('deskripsi', 'str', True),
+    'order_number': ('no. pesanan', 'str', True),
+    'transaction_category': ('jenis transaksi', 'str', True),
+    'amount': ('jumlah', 'float', True),
+    'status': ('status', 'str', True),
+    'ending_balance': ('saldo akhir', 'float', True)
+}
+
+def get_schema_columns(schema, required_only=False):
+    return [column for column, (source, dtype, required) in schema.items() if required or not required_only]
+
+def get_schema_usecols(schema, required_only=False):
+    """
+    Return the usecols function for the raw file reader, so only the columns in the schema are parsed.
+    """
+    source_columns = {schema[column][0] for column in get_schema_columns(schema, required_only)}
+    return lambda col: str(col).lower() in source_columns
+
+def get_schema_headers(schema):
+    """
+    Return the raw file headers of the required columns, used to locate the header row.
+    Blank headers ('unnamed: n') are left out, their name depends on the column position.
+    """
+    return [schema[column][0] for column in get_schema_columns(schema, required_only=True)
+            if not schema[column][0].startswith('unnamed:')]
+
+def apply_schema(df, schema, path, required_only=False, number_format=('.', ','), loader=None):
+    """
+    Rename the raw file columns, select the schema columns and clean the data type.
+    Raises ValueError when a required column is missing or the data type cannot be cleaned,
+    so the file is reported in the read errors of the loader.
+
+    number_format : (thousand separator, decimal separator) of the 'money' columns, see get_number_format
+    loader : name of the loader, the detected datetime formats are cached per loader
+    """
+    column_mapping = {source: column for column, (source, dtype, required) in schema.items()}
+    columns = get_schema_columns(schema, required_only)
+
+    df.columns = [column_mapping.get(str(col).lower(), col) for col in df.columns]
+
+    missing_columns = [column for column in columns if column not in df.columns]
+    missing_required = [column for column in missing_columns if schema[column][2]]
+
+    if missing_required:
+        raise ValueError(f'Column schema has changed: {path}. Missing column: {missing_required}')
+
+    present_columns = [column for column in columns if column not in missing_columns]
+    df = df[present_columns]
+
+    # Clean Data Type
+
+    try:
+
+        df = coerce_datetime_columns(df, [column for column in present_columns if schema[column][1] == 'datetime'], cache_key=loader)
+
+        for i in [column for column in present_columns if schema[column][1] == 'int']:
+            df[i] = df[i].astype('int64')
+
+        df = coerce_number_columns(df, [column for column in present_columns if schema[column][1] == 'money'],
+                                   thousands_sep=number_format[0], decimal_sep=number_format[1])
+
+        for f in [column for column in present_columns if schema[column][1] == 'float']:
+            df[f] = df[f].astype(float)
+
+    except Exception as e:
+        raise ValueError(f'There is some issue when cleaning the data type: {path}. Error: {str(e)}') from e
+
+    # Missing optional columns are added as typed null columns, so the table schema stays the same
+    if missing_columns:
+        null_dtype = {'str': 'object', 'datetime': 'datetime64[ns]', 'int': 'Int64', 'float': 'float64', 'money': 'float64'}
+
+        for column in missing_columns:
+            df[column] = pd.Series(index=df.index, dtype=null_dtype[schema[column][1]])
+
+        df = df[columns]
+
+    return df
@@ -13,32 +13,47 @@ from data_loader.sp_income_released import sp_income_released
 from data_loader.sp_order_data import sp_order_data
 from data_loader.sp_pay_wallet import sp_pay_wallet
 
-tasks = [
-
-    (update_folder_structure, {'target_path': os.getenv("RC_RAW_FILE_PATH"),
-                               'structure_file' : os.getenv("RC_FOLDER_STRUCTURE_JSON")}),
-
-    (main_local_to_drive, {}),
-    (main_drive_to_local, {}),
-    
-    (sp_income_released, {'count_file': 1000,
-                          'target_table': 'report_rc.sp_income_released',
-                          'db_method': 'replace',
-                          'data_path' : rc_shopee_income_path,
-                          'store_dim' : rc_shopee_store_info}),
-
-    (sp_order_data, {'count_file': 1000,
-                     'target_table': 'report_rc.sp_order_data',
-                     'db_method': 'replace',
-                     'data_path' : rc_shopee_order_path,
-                     'store_dim' : rc_shopee_store_info}),
-
-    (sp_pay_wallet, {'count_file': 1000,
-                     'target_table': 'report_rc.sp_pay_wallet',
-                     'db_method': 'replace',
-                     'data_path' : rc_shopee_pay_path,
-                     'store_dim' : rc_shopee_store_info}),
-
-]
-
-log_function(tasks)
\ No newline at end of file
+if __name__ == '__main__':
+
+    tasks = [
+
+        (update_folder_structure, {'target_path': os.getenv("RC_RAW_FILE_PATH"),
+                                   'structure_file' : os.getenv("RC_FOLDER_STRUCTURE_JSON")}),
+
+        (main_local_to_drive, {}),
+        (main_drive_to_local, {}),
+
+        (sp_income_released, {'count_file': 1000,
+                              'target_table': 'report_rc.sp_income_released',
+                              'db_method': 'upsert',
+                              'data_path' : rc_shopee_income_path,
+                              'store_dim' : rc_shopee_store_info,
+                              'max_workers' : os.cpu_count(),
+                              'incremental' : True,
+                              'use_cache' : True,
+                              'row_budget' : 200000}),
+
+        (sp_order_data, {'count_file': 1000,
+                         'target_table': 'report_rc.sp_order_data',
+                         'db_method': 'upsert',
+                         'data_path' : rc_shopee_order_path,
+                         'store_dim' : rc_shopee_store_info,
+                         'max_workers' : os.cpu_count(),
+                         'incremental' : True,
+                         'use_cache' : True,
+                         'chunk_size' : 50000,
+                         'row_budget' : 200000}),
+
+        (sp_pay_wallet, {'count_file': 1000,
+                         'target_table': 'report_rc.sp_pay_wallet',
+                         'db_method': 'replace', # the wallet unique id still has duplicates (see sp_pay_wallet), a MERGE on it is not safe
+                         'data_path' : rc_shopee_pay_path,
+                         'store_dim' : rc_shopee_store_info,
+                         'max_workers' : os.cpu_count(),
+                         'incremental' : True,
+                         'use_cache' : True,
+                         'row_budget' : 200000}),
+
+    ]
+
+    log_function(tasks)
\ No newline at end of file
@@ -4,9 +4,174 @@ load_dotenv()
 import sys,os
 sys.path.insert(0, os.getenv("PROJECT_PATH"))
 
+from functools import partial
+
 from bi_function import *
+from bi_query_cache import read_from_gbq_cached
+from data_loader.sp_schema import sp_income_schema, sp_wallet_schema, get_schema_columns
 from report_rc.rc_setup import *
 
+# COLUMN PROJECTION
+# Columns each journal stage consumes, the queries below select only these instead of SELECT *.
+# The month and store dimension columns are dropped by the journal, so they are not read.
+
+JOURNAL_INCOME_COLUMNS = ['folder_id'] + get_schema_columns(sp_income_schema) # create_journal_base
+JOURNAL_WALLET_COLUMNS = ['folder_id'] + get_schema_columns(sp_wallet_schema) # create_journal_base
+PENDING_INCOME_COLUMNS = ['month_income', 'month_order'] + JOURNAL_INCOME_COLUMNS # pending_last_month, latest income of the pending orders
+PENDING_BASE_EXCLUDED_COLUMNS = ['month_income', 'month_order'] + [f'i_{col}' for col in get_schema_columns(sp_income_schema) if col != 'order_number'] # pending_last_month, replaced by the latest income
+JOURNAL_ORDER_EXCLUDED_COLUMNS = ['o_order_status'] # withdrawn_last_month, only in rpt_sp_journal_order, dropped by the journal base column alignment
+
+# QUERY TEMPLATES
+# The queries are built once with the project id, the values are bound per call as query parameters (@name),
+# so every store / month sends the same query text. Month lists are ARRAY<STRING> parameters used with IN UNNEST(@...).
+# rpt_sp_journal_base is partitioned by report_month (_PARTITIONTIME), and the month_order / month_wallet of a base row
+# is its report_month or null, so every month filter on the base also filters _PARTITIONTIME (@..._partitions) to prune the scan.
+
+SQL_ORDER_MONTH = f'''SELECT DATE(order_creation_time) AS order_creation_time,folder_id,order_number,
+                        SUM(total_product_price) AS total_product_price
+                FROM `{BI_PROJECT_ID}.report_rc.sp_order_data`
+                WHERE (UPPER(order_status) != 'BATAL')
+                    AND (LENGTH(order_number) > 1)
+                    AND (month_order = @data_month)
+                    AND (folder_id = @folder_id)
+                GROUP BY DATE(order_creation_time),folder_id,order_number
+    '''
+
+SQL_INCOME_MONTH = f'''SELECT {get_select_list(JOURNAL_INCOME_COLUMNS)}
+                        FROM `{BI_PROJECT_ID}.report_rc.sp_income_released`
+                        WHERE (month_income = @data_month)
+                            AND (month_order = @data_month)
+                            AND (LENGTH(order_number) > 1)
+                            AND (folder_id = @folder_id)
+    '''
+
+SQL_WALLET_MONTH = f'''SELECT {get_select_list(JOURNAL_WALLET_COLUMNS)}
+                        FROM `{BI_PROJECT_ID}.report_rc.sp_pay_wallet`
+                        WHERE (month_wallet = @data_month)
+                            AND (folder_id = @folder_id)
+                        ORDER BY transaction_date DESC
+    '''
+
+SQL_ORDER_PERIOD = f'''SELECT DATE(order_creation_time) AS order_creation_time,folder_id,order_number,order_status,
+                            SUM(total_product_price) AS total_product_price
+                        FROM `{BI_PROJECT_ID}.report_rc.sp_order_data`
+                        WHERE (DATE(order_creation_time) BETWEEN @start_date AND @end_date)
+                            AND (LENGTH(order_number) > 1)
+                        GROUP BY DATE(order_creation_time),folder_id,order_number,order_status'''
+
+SQL_INCOME_PERIOD = f'''SELECT {get_select_list(JOURNAL_INCOME_COLUMNS)} FROM `{BI_PROJECT_ID}.report_rc.sp_income_released`
+                       WHERE (DATE(order_creation_time) BETWEEN @start_date AND @end_date)
+                            AND (LENGTH(order_number) > 1)'''
+
+SQL_WALLET_PERIOD = f'''SELECT {get_select_list(JOURNAL_WALLET_COLUMNS)} FROM `{BI_PROJECT_ID}.report_rc.sp_pay_wallet`
+                       WHERE (DATE(transaction_date) BETWEEN @start_date AND @end_date)
+                            AND (LENGTH(order_number) > 1)
+                        ORDER BY transaction_date DESC'''
+
+SQL_WALLET_WITHDRAWAL_MONTHS = f'''WITH all_month_wallet AS (
+    SELECT DISTINCT month_wallet
+    FROM `{BI_PROJECT_ID}.report_rc.sp_pay_wallet`
+    WHERE folder_id = @folder_id
+    AND month_wallet IN UNNEST(@prev_month_list)
+),
+month_with_penarikan_dana AS (
+    SELECT DISTINCT month_wallet, 'Yes' AS penarikan_dana_flag
+    FROM `{BI_PROJECT_ID}.report_rc.sp_pay_wallet`
+    WHERE folder_id = @folder_id
+    AND LOWER(description) LIKE '%penarikan dana%'
+)
+SELECT 
+    a.month_wallet,
+    COALESCE(m.penarikan_dana_flag, 'No') AS penarikan_dana_flag
+FROM all_month_wallet AS a
+LEFT JOIN month_with_penarikan_dana AS m
+ON a.month_wallet = m.month_wallet
+ORDER BY a.month_wallet'''
+
+SQL_WITHDRAWN_LAST_MONTH = f'''
+    WITH order_income AS (
+        SELECT * EXCEPT ({get_select_list(JOURNAL_ORDER_EXCLUDED_COLUMNS)})
+        FROM `{BI_PROJECT_ID}.report_rc.rpt_sp_journal_order` AS income_data
+        WHERE month_income IN UNNEST(@before_this_month_included)
+        AND folder_id = @folder_id
+        AND EXISTS (
+            SELECT 1
+            FROM `{BI_PROJECT_ID}.report_rc.rpt_sp_journal_base` AS order_data
+            WHERE order_data.folder_id = @folder_id
+                AND order_data.order_number = income_data.order_number
+                AND order_data.month_order IN UNNEST(@before_this_month_excluded)
+                AND order_data._PARTITIONTIME IN UNNEST(@before_this_month_excluded_partitions)
+                AND order_data.sheet_piutang = 1
+                AND order_data.folder_id = income_data.folder_id
+        )
+    ),
+    wallet_data AS (
+        SELECT folder_id, order_number, wp_has_been_withdrawn, wp_this_month_order, wp_described_as_income,
+                sheet_omset, sheet_wp, sheet_piutang
+        FROM `{BI_PROJECT_ID}.report_rc.rpt_sp_journal_base`
+        WHERE month_wallet IN UNNEST(@month_wallet_list)
+        AND _PARTITIONTIME IN UNNEST(@month_wallet_partitions)
+        AND wp_described_as_income = 1
+        AND folder_id = @folder_id
+        AND sheet_piutang = 0 -- or can try 'AND sheet_piutang != 1' as well, during the test the result is the same
+    )
+    SELECT 
+        order_income.*, 
+        wallet_data.wp_has_been_withdrawn,
+        wallet_data.wp_this_month_order,
+        wallet_data.wp_described_as_income,
+        wallet_data.sheet_omset,
+        wallet_data.sheet_wp,
+        wallet_data.sheet_piutang
+    FROM 
+        order_income
+    INNER JOIN
+        wallet_data
+    ON 
+        order_income.folder_id = wallet_data.folder_id
+        AND order_income.order_number = wallet_data.order_number
+'''
+
+SQL_WITHDRAWN_LAST_MONTH_ADD = f'''SELECT * EXCEPT ({get_select_list(JOURNAL_ORDER_EXCLUDED_COLUMNS)})
+            FROM `{BI_PROJECT_ID}.report_rc.rpt_sp_journal_order` AS income_data
+            WHERE month_income >= @report_month
+            AND folder_id = @folder_id
+            AND i_total_income = 0
+            AND month_wallet is null
+            AND EXISTS (
+                SELECT 1
+                FROM `{BI_PROJECT_ID}.report_rc.rpt_sp_journal_base` AS order_data
+                WHERE order_data.folder_id = @folder_id
+                    AND order_data.order_number = income_data.order_number
+                    AND order_data.month_order IN UNNEST(@before_this_month_excluded)
+                    AND order_data._PARTITIONTIME IN UNNEST(@before_this_month_excluded_partitions)
+                    AND order_data.sheet_piutang = 1
+                    AND order_data.folder_id = income_data.folder_id)'''
+
+SQL_COUNT_WITHDRAWAL = f'''SELECT count(1) FROM `{BI_PROJECT_ID}.report_rc.rpt_sp_journal_base`
+WHERE month_wallet = @report_month AND _PARTITIONTIME = @report_partition AND folder_id = @folder_id
+AND LOWER(w_description) LIKE '%penarikan dana%' '''
+
+SQL_PENDING_LAST_MONTH = f'''SELECT * EXCEPT ({get_select_list(PENDING_BASE_EXCLUDED_COLUMNS)}) FROM `{BI_PROJECT_ID}.report_rc.rpt_sp_journal_base`
+            WHERE (month_wallet IN UNNEST(@month_wallet_list))
+                  AND (_PARTITIONTIME IN UNNEST(@month_wallet_partitions))
+                  AND (wp_has_been_withdrawn = 0)
+                  AND (folder_id = @folder_id)
+                  AND (NOT @income_only OR wp_described_as_income = 1)'''
+
+SQL_JOURNAL_BASE_MONTH = f'''SELECT * FROM `{BI_PROJECT_ID}.report_rc.rpt_sp_journal_base`
+            WHERE _PARTITIONTIME = @report_partition AND report_month = @report_month AND folder_id = @folder_id
+        '''
+
+SQL_ORDER_TRANSFORM_DATE_MAP = f'''SELECT CONCAT(folder_id,order_number) AS uq_id,month_order,month_income,month_wallet,
+                                o_order_creation_time, i_fund_release_date, w_transaction_date
+                        FROM `{BI_PROJECT_ID}.report_rc.rpt_sp_journal_order_transform`
+                        WHERE folder_id = @folder_id AND month_order IN UNNEST(@before_this_month_included)
+                        '''
+
+def get_partition_times(month_list):
+    return [get_partition_month(month)[1] for month in month_list] # _PARTITIONTIME of every report month
+
 def transform_wallet_data(df):
 
     df_copy = df.copy()
@@ -56,7 +221,7 @@ def transform_wallet_data(df):
 
     return final_pivot
 
-def create_journal_base(journal_base=True,data_month=None,folder_id=None,start_date=None,db_method='append',transform=True):
+def create_journal_base(journal_base=True,data_month=None,folder_id=None,start_date=None,db_method='append',transform=True,buffered=False):
 
     """ 
     Description:
@@ -68,60 +233,25 @@ def create_journal_base(journal_base=True,data_month=None,folder_id=None,start_d
         This mode tracks each order across time periods, providing a comprehensive view at the order level only.
         The data is matched based on the order number, regardless of whether the funds were released,
         or the wallet transaction occurred in a different month.   
+    - If `buffered` is set to True, the journal base is added to the write buffer and written by flush_write_buffer,
+        so the journal base of every store in the same month is loaded together.
     """
 
     if journal_base:
         print(f"\033[1;32m🚀 Process Journal for : {folder_id}, month = {data_month} 🚀\033[0m")
 
-        query_order = f'''SELECT DATE(order_creation_time) AS order_creation_time,folder_id,order_number,
-                            SUM(total_product_price) AS total_product_price
-                    FROM `{BI_PROJECT_ID}.report_rc.sp_order_data`
-                    WHERE (UPPER(order_status) != 'BATAL')
-                        AND (LENGTH(order_number) > 1)
-                        AND (month_order = '{data_month}')
-                        AND (folder_id = '{folder_id}')
-                    GROUP BY DATE(order_creation_time),folder_id,order_number
-        '''
-
-        query_income = f'''SELECT *
-                            FROM `{BI_PROJECT_ID}.report_rc.sp_income_released`
-                            WHERE (month_income = '{data_month}')
-                                AND (month_order = '{data_month}')
-                                AND (LENGTH(order_number) > 1)
-                                AND (folder_id = '{folder_id}')
-        '''
-
-        query_wallet = f'''SELECT *
-                            FROM `{BI_PROJECT_ID}.report_rc.sp_pay_wallet`
-                            WHERE (month_wallet = '{data_month}')
-                                AND (folder_id = '{folder_id}')
-                            ORDER BY transaction_date DESC
-        '''
+        query_order, query_income, query_wallet = SQL_ORDER_MONTH, SQL_INCOME_MONTH, SQL_WALLET_MONTH
+        query_params = {'data_month': data_month, 'folder_id': folder_id}
     
     elif not journal_base:
         print(f"\033[1;32m📋 Combined All Order, Income & Wallet Data 📋\033[0m")
 
-        today_date = datetime.today().strftime('%Y-%m-%d')
-
-        query_order = f'''SELECT DATE(order_creation_time) AS order_creation_time,folder_id,order_number,order_status,
-                                SUM(total_product_price) AS total_product_price
-                            FROM `{BI_PROJECT_ID}.report_rc.sp_order_data`
-                            WHERE (DATE(order_creation_time) BETWEEN '{start_date}' AND '{today_date}')
-                                AND (LENGTH(order_number) > 1)
-                            GROUP BY DATE(order_creation_time),folder_id,order_number,order_status'''
+        query_order, query_income, query_wallet = SQL_ORDER_PERIOD, SQL_INCOME_PERIOD, SQL_WALLET_PERIOD
+        query_params = {'start_date': datetime.strptime(start_date, '%Y-%m-%d').date(), 'end_date': datetime.today().date()}
 
-        query_income = f'''SELECT * FROM `{BI_PROJECT_ID}.report_rc.sp_income_released`
-                           WHERE (DATE(order_creation_time) BETWEEN '{start_date}' AND '{today_date}')
-                                AND (LENGTH(order_number) > 1)'''
-
-        query_wallet = f'''SELECT * FROM `{BI_PROJECT_ID}.report_rc.sp_pay_wallet`
-                           WHERE (DATE(transaction_date) BETWEEN '{start_date}' AND '{today_date}')
-                                AND (LENGTH(order_number) > 1)
-                            ORDER BY transaction_date DESC'''
-
-    df_order = read_from_gbq(BI_CLIENT,query_order)
-    df_income = read_from_gbq(BI_CLIENT,query_income)
-    df_wallet = read_from_gbq(BI_CLIENT,query_wallet)
+    df_order = read_from_gbq(BI_CLIENT,query_order,params=query_params)
+    df_income = read_from_gbq(BI_CLIENT,query_income,params=query_params)
+    df_wallet = read_from_gbq(BI_CLIENT,query_wallet,params=query_params)
 
     if len(df_order) == 0 or len(df_income) == 0 or len(df_wallet) == 0:
         empty_dfs = []
@@ -333,10 +463,13 @@ def create_journal_base(journal_base=True,data_month=None,folder_id=None,start_d
     # Load to GBQ
     
     if journal_base:
-        write_table_by_unique_id(df_order_income_wallet,
+        write_function = partial(buffer_write, write_table_by_partition) if buffered else write_table_by_partition
+
+        write_function(df_order_income_wallet,
                                 target_table = 'report_rc.rpt_sp_journal_base',
                                 write_method=db_method,
-                                unique_col_ref = ['report_month','folder_id']
+                                month_col_ref = 'report_month', # partitioned by report month, clustered on report_month + folder_id
+                                cluster_col_ref = ['folder_id']
                                 )
     elif not journal_base and not transform:
         write_table_by_unique_id(df_order_income_wallet,
@@ -358,27 +491,7 @@ def check_previous_wallet_with_no_withdrawn_at_all_in_month(report_month,folder_
 
     previous_month = (datetime.strptime(report_month, '%Y%m').replace(day=1) - timedelta(days=1)).strftime('%Y%m')
 
-    query = f'''WITH all_month_wallet AS (
-        SELECT DISTINCT month_wallet
-        FROM `{BI_PROJECT_ID}.report_rc.sp_pay_wallet`
-        WHERE folder_id = '{folder_id}'
-        AND month_wallet IN {tuple(prev_month_list)}
-    ),
-    month_with_penarikan_dana AS (
-        SELECT DISTINCT month_wallet, 'Yes' AS penarikan_dana_flag
-        FROM `{BI_PROJECT_ID}.report_rc.sp_pay_wallet`
-        WHERE folder_id = '{folder_id}'
-        AND LOWER(description) LIKE '%penarikan dana%'
-    )
-    SELECT 
-        a.month_wallet,
-        COALESCE(m.penarikan_dana_flag, 'No') AS penarikan_dana_flag
-    FROM all_month_wallet AS a
-    LEFT JOIN month_with_penarikan_dana AS m
-    ON a.month_wallet = m.month_wallet
-    ORDER BY a.month_wallet'''
-
-    df = read_from_gbq(BI_CLIENT,query)
+    df = read_from_gbq_cached(BI_CLIENT,SQL_WALLET_WITHDRAWAL_MONTHS,params={'folder_id': folder_id, 'prev_month_list': prev_month_list}) # called by withdrawn_last_month and pending_last_month with the same query
 
     # Initialize an empty list to store the result
     result = []
@@ -422,60 +535,19 @@ def withdrawn_last_month(report_month,folder_id):
     before_this_month_excluded = [(datetime.strptime(report_month, "%Y%m").replace(day=1) - timedelta(days=30 * i)).strftime("%Y%m") for i in range(1, 13)]
     before_this_month_included = [(datetime.strptime(report_month, "%Y%m").replace(day=1) - timedelta(days=30 * i)).strftime("%Y%m") for i in range(0, 13)]
 
-    if isinstance(no_withdrawn_in_a_month, str):
-        month_wallet_condition = f"month_wallet = '{no_withdrawn_in_a_month}'"
-    elif isinstance(no_withdrawn_in_a_month, tuple):
-        month_wallet_condition = f"month_wallet IN {tuple(no_withdrawn_in_a_month)}"
+    month_wallet_list = [no_withdrawn_in_a_month] if isinstance(no_withdrawn_in_a_month, str) else list(no_withdrawn_in_a_month)
 
     # We use a list of months instead of only the previous month because there are cases
     # where an order is recorded in the wallet as sales after a delay.
     # For example, an order might be created in May 2024, with no wallet data for it in May 2024 or June 2024,
     # but it only appears in the wallet data in July 2024. Therefore, we need to check 'Piutang' (accounts receivable) from the last few months.
 
-    query = f'''
-        WITH order_income AS (
-            SELECT *
-            FROM `{BI_PROJECT_ID}.report_rc.rpt_sp_journal_order` AS income_data
-            WHERE month_income IN {tuple(before_this_month_included)}
-            AND folder_id = '{folder_id}'
-            AND EXISTS (
-                SELECT 1
-                FROM `{BI_PROJECT_ID}.report_rc.rpt_sp_journal_base` AS order_data
-                WHERE order_data.folder_id = '{folder_id}'
-                    AND order_data.order_number = income_data.order_number
-                    AND order_data.month_order IN {tuple(before_this_month_excluded)}
-                    AND order_data.sheet_piutang = 1
-                    AND order_data.folder_id = income_data.folder_id
-            )
-        ),
-        wallet_data AS (
-            SELECT folder_id, order_number, wp_has_been_withdrawn, wp_this_month_order, wp_described_as_income,
-                    sheet_omset, sheet_wp, sheet_piutang
-            FROM `{BI_PROJECT_ID}.report_rc.rpt_sp_journal_base`
-            WHERE {month_wallet_condition}
-            AND wp_described_as_income = 1
-            AND folder_id = '{folder_id}'
-            AND sheet_piutang = 0 -- or can try 'AND sheet_piutang != 1' as well, during the test the result is the same
-        )
-        SELECT 
-            order_income.*, 
-            wallet_data.wp_has_been_withdrawn,
-            wallet_data.wp_this_month_order,
-            wallet_data.wp_described_as_income,
-            wallet_data.sheet_omset,
-            wallet_data.sheet_wp,
-            wallet_data.sheet_piutang
-        FROM 
-            order_income
-        INNER JOIN
-            wallet_data
-        ON 
-            order_income.folder_id = wallet_data.folder_id
-            AND order_income.order_number = wallet_data.order_number
-    '''
-    
+    query_params = {'folder_id': folder_id, 'month_wallet_list': month_wallet_list, 'month_wallet_partitions': get_partition_times(month_wallet_list),
+                    'before_this_month_included': before_this_month_included, 'before_this_month_excluded': before_this_month_excluded,
+                    'before_this_month_excluded_partitions': get_partition_times(before_this_month_excluded)}
+
     try:
-        df = read_from_gbq(BI_CLIENT, query)
+        df = read_from_gbq(BI_CLIENT, SQL_WITHDRAWN_LAST_MONTH, params=query_params)
         
         if df.empty: # Check if the DataFrame is empty
             print(f"⚠️ withdrawn_last_month : no data found for the previous month ({no_withdrawn_in_a_month}) and folder index ({folder_id})")
@@ -489,23 +561,10 @@ def withdrawn_last_month(report_month,folder_id):
     # Adding Additional Data
     # Previous month data already refund to customer in Income Data, but has never been showing in Wallet Data
 
-    query_add = f'''SELECT *
-                FROM `{BI_PROJECT_ID}.report_rc.rpt_sp_journal_order` AS income_data
-                WHERE month_income >= '{report_month}'
-                AND folder_id = '{folder_id}'
-                AND i_total_income = 0
-                AND month_wallet is null
-                AND EXISTS (
-                    SELECT 1
-                    FROM `{BI_PROJECT_ID}.report_rc.rpt_sp_journal_base` AS order_data
-                    WHERE order_data.folder_id = '{folder_id}'
-                        AND order_data.order_number = income_data.order_number
-                        AND order_data.month_order IN {tuple(before_this_month_excluded)}
-                        AND order_data.sheet_piutang = 1
-                        AND order_data.folder_id = income_data.folder_id)'''
-    
     try:
-        df_add = read_from_gbq(BI_CLIENT,query_add)
+        df_add = read_from_gbq(BI_CLIENT,SQL_WITHDRAWN_LAST_MONTH_ADD,
+                               params={'report_month': report_month, 'folder_id': folder_id, 'before_this_month_excluded': before_this_month_excluded,
+                                       'before_this_month_excluded_partitions': get_partition_times(before_this_month_excluded)})
 
         if df_add.empty: # Check if the DataFrame is empty
             print(f"⚠️ ADDITIONAL DATA - withdrawn_last_month : no data found for the previous month ({no_withdrawn_in_a_month}) and folder index ({folder_id})")
@@ -551,9 +610,9 @@ def withdrawn_last_month(report_month,folder_id):
 
     # Arrange Column Order
 
-    journal_base_raw_col_list = read_from_gbq(BI_CLIENT,f'SELECT * FROM `{BI_PROJECT_ID}.report_rc.rpt_sp_journal_base` LIMIT 1')
+    journal_base_raw_col_list = get_table_columns(f'{BI_PROJECT_ID}.report_rc.rpt_sp_journal_base') # metadata only, no query job
 
-    df_filtered = df_concat_again[journal_base_raw_col_list.columns.tolist()]
+    df_filtered = df_concat_again[journal_base_raw_col_list]
 
     df_filtered['idx_sheet_temp'] = 1 # so we can align with calculate_debit_credit function later
 
@@ -568,32 +627,19 @@ def pending_last_month(report_month,folder_id,month_col_ref):
 
     month_list = check_previous_wallet_with_no_withdrawn_at_all_in_month(report_month,folder_id,include_current_month=False)
 
-    if isinstance(month_list, str):
-        month_wallet_condition = f"month_wallet = '{month_list}'"
-    elif isinstance(month_list, tuple):
-        month_wallet_condition = f"month_wallet IN {tuple(month_list)}"
+    month_wallet_list = [month_list] if isinstance(month_list, str) else list(month_list)
 
     # Check whether in the report_month there is a withdrawal activity
-    count_withdrawal = read_from_gbq(BI_CLIENT,f'''SELECT count(1) FROM `{BI_PROJECT_ID}.report_rc.rpt_sp_journal_base`
-    WHERE month_wallet = '{report_month}' AND folder_id = '{folder_id}'
-    AND LOWER(w_description) LIKE '%penarikan dana%' ''')
+    count_withdrawal = read_from_gbq(BI_CLIENT,SQL_COUNT_WITHDRAWAL,params={'report_month': report_month, 'report_partition': get_partition_month(report_month)[1], 'folder_id': folder_id})
 
     if count_withdrawal.iloc[0, 0] == 0:
         return pd.DataFrame()
     
-    if month_col_ref == 'month_income':
-        additional_conditions = 'AND (wp_described_as_income = 1)'
-    else:
-        additional_conditions = ''
-    
-    query = f'''SELECT * FROM `{BI_PROJECT_ID}.report_rc.rpt_sp_journal_base`
-                WHERE ({month_wallet_condition})
-                      AND (wp_has_been_withdrawn = 0)
-                      AND (folder_id = '{folder_id}')
-                      {additional_conditions}'''
+    query_params = {'month_wallet_list': month_wallet_list, 'month_wallet_partitions': get_partition_times(month_wallet_list), 'folder_id': folder_id,
+                    'income_only': month_col_ref == 'month_income'} # only wp_described_as_income = 1 for month_income
     
     try:
-        df = read_from_gbq(BI_CLIENT, query)
+        df = read_from_gbq(BI_CLIENT, SQL_PENDING_LAST_MONTH, params=query_params)
         # Check if the DataFrame is empty
         if df.empty:
             print(f"⚠️ pending_last_month : no data found for the previous month ({month_list}), folder index ({folder_id})")
@@ -605,7 +651,7 @@ def pending_last_month(report_month,folder_id,month_col_ref):
         return pd.DataFrame()
 
     # Localize Time
-    for d in ['o_order_creation_time','i_order_creation_time','i_fund_release_date','w_transaction_date']:
+    for d in ['o_order_creation_time','w_transaction_date']: # the income columns are not read, see SQL_PENDING_LAST_MONTH
         df[d] = df[d].dt.tz_localize(None)
 
     # Add Report Month
@@ -616,23 +662,24 @@ def pending_last_month(report_month,folder_id,month_col_ref):
     df_search_income = df.drop(columns=[col for col in df.columns if col in ['month_income', 'month_order'] or col.startswith('i_')])
 
     order_reference = df_search_income[['folder_id','order_number']].drop_duplicates()
-    write_to_gbq(order_reference, BI_PROJECT_ID, BI_CREDENTIAL, 'data_stage.rc_order_ref_search_income', 'replace', 'asia-southeast2')
-    time.sleep(1)
-
-    query_try_income = f'''SELECT * 
-                            FROM `{BI_PROJECT_ID}.report_rc.sp_income_released` AS i
-                            WHERE EXISTS (
-                                SELECT 1
-                                FROM `{BI_PROJECT_ID}.data_stage.rc_order_ref_search_income` AS r
-                                WHERE i.folder_id = r.folder_id
-                                AND i.order_number = r.order_number
-                            )
-                            '''
+    with stage_table_scope('rc_order_ref_search_income') as stage_table: # one stage table per call, stores and months can run in parallel
+        write_stage_table(order_reference, stage_table)
+        time.sleep(1)
+
+        query_try_income = f'''SELECT {get_select_list(PENDING_INCOME_COLUMNS)}
+                                FROM `{BI_PROJECT_ID}.report_rc.sp_income_released` AS i
+                                WHERE EXISTS (
+                                    SELECT 1
+                                    FROM `{BI_PROJECT_ID}.{stage_table}` AS r
+                                    WHERE i.folder_id = r.folder_id
+                                    AND i.order_number = r.order_number
+                                )
+                                '''
+
+        df_try_income = read_from_gbq(BI_CLIENT,query_try_income)
 
-    df_try_income = read_from_gbq(BI_CLIENT,query_try_income)
     df_try_income['order_creation_time'] = pd.to_datetime(df_try_income['order_creation_time']).dt.tz_localize(None)
     df_try_income['fund_release_date'] = pd.to_datetime(df_try_income['fund_release_date']).dt.tz_localize(None)
-    df_try_income = df_try_income.drop(columns=['store_id','country','currency','platform','store'])
     df_try_income = df_try_income.rename(columns={col: f'i_{col}' for col in df_try_income.columns if col not in ['month_income','month_order','folder_id','order_number']})
 
     df_merge_income = df_search_income.merge(df_try_income,on=['folder_id','order_number'],how='left')
@@ -643,9 +690,9 @@ def pending_last_month(report_month,folder_id,month_col_ref):
 
     # Arrange Column Order
 
-    journal_base_raw_col_list = read_from_gbq(BI_CLIENT,f'SELECT * FROM `{BI_PROJECT_ID}.report_rc.rpt_sp_journal_base` LIMIT 1')
+    journal_base_raw_col_list = get_table_columns(f'{BI_PROJECT_ID}.report_rc.rpt_sp_journal_base') # metadata only, no query job
 
-    df_filtered = df_not_null[journal_base_raw_col_list.columns.tolist()]
+    df_filtered = df_not_null[journal_base_raw_col_list]
 
     df_filtered['idx_sheet_temp'] = 1 # so we can align with calculate_debit_credit function later
 
@@ -676,15 +723,11 @@ def calculate_debit_credit(df,col_filter,col_list_to_sum,sort_index,category_nam
 
     return df_filter
 
-def create_journal_dashboard(report_month,folder_id,db_method='append'):
+def create_journal_dashboard(report_month,folder_id,db_method='append',buffered=False):
 
     print(f"\033[1;32m📊 Journal Dashboard for : {folder_id}, month = {report_month} 📊\033[0m")
 
-    query = f'''SELECT * FROM `{BI_PROJECT_ID}.report_rc.rpt_sp_journal_base`
-                WHERE report_month = '{report_month}' AND folder_id = '{folder_id}'
-            '''
-
-    df_base = read_from_gbq(BI_CLIENT,query)
+    df_base = read_from_gbq(BI_CLIENT,SQL_JOURNAL_BASE_MONTH,params={'report_month': report_month, 'report_partition': get_partition_month(report_month)[1], 'folder_id': folder_id})
 
     if not len(df_base) > 0:
         print(f"Skip creating journal dashboard: journal base data is empty")
@@ -794,11 +837,7 @@ def create_journal_dashboard(report_month,folder_id,db_method='append'):
     # Mapping All Date
     before_this_month_included = [(datetime.strptime(report_month, "%Y%m").replace(day=1) - timedelta(days=30 * i)).strftime("%Y%m") for i in range(0, 13)]
 
-    map_date = read_from_gbq(BI_CLIENT,f'''SELECT CONCAT(folder_id,order_number) AS uq_id,month_order,month_income,month_wallet,
-                                                    o_order_creation_time, i_fund_release_date, w_transaction_date
-                                            FROM `{BI_PROJECT_ID}.report_rc.rpt_sp_journal_order_transform`
-                                            WHERE folder_id = '{folder_id}' AND month_order IN {tuple(before_this_month_included)}
-                                            ''')
+    map_date = read_from_gbq_cached(BI_CLIENT,SQL_ORDER_TRANSFORM_DATE_MAP,params={'folder_id': folder_id, 'before_this_month_included': before_this_month_included})
     map_date = map_date.drop_duplicates(subset=['uq_id'])
 
     map_month_order = map_date.set_index('uq_id')['month_order'].to_dict()
@@ -923,26 +962,38 @@ def create_journal_dashboard(report_month,folder_id,db_method='append'):
     'diskon_produk_dari_shopee','biaya_ams','biaya_admin','biaya_layanan',
     'biaya_program','penarikan_dana','piutang','other_wallet_income','other_wallet_expense']
 
-    df_group = df_concat.groupby(by_group)[sum_group].sum().reset_index()
+    # The group columns only have a few distinct values, group them as categorical (observed combinations only)
+    df_group = df_concat.astype({col: 'category' for col in by_group}).groupby(by_group, observed=True)[sum_group].sum().reset_index()
 
     # Load to GBQ
+
+    # buffered : the report and dashboard are added to the write buffer and written by flush_write_buffer
+    write_function = partial(buffer_write, write_table_by_partition) if buffered else write_table_by_partition
     
-    write_table_by_unique_id(df_concat,
+    write_function(df_concat,
                                 target_table = 'report_rc.rpt_sp_journal_report',
                                 write_method=db_method,
-                                unique_col_ref = ['report_month','folder_id']
+                                month_col_ref = 'report_month', # partitioned by report month, clustered on report_month + folder_id
+                                cluster_col_ref = ['folder_id']
                             )
     
-    write_table_by_unique_id(df_group,
+    write_function(df_group,
                                 target_table = 'report_rc.rpt_sp_journal_dashboard',
                                 write_method=db_method,
-                                unique_col_ref = ['report_month','folder_id']
+                                month_col_ref = 'report_month', # partitioned by report month, clustered on report_month + folder_id
+                                cluster_col_ref = ['folder_id']
                             )
     
 if __name__ == '__main__':
     
     tasks = [
 
+        # 0. The journal tables are read and written by month partition (_PARTITIONTIME),
+        # the tables created before the partitioning are migrated once, the next runs only check them
+        (migrate_to_partitioned_table, {'target_table': 'report_rc.rpt_sp_journal_base'}),
+        (migrate_to_partitioned_table, {'target_table': 'report_rc.rpt_sp_journal_report'}),
+        (migrate_to_partitioned_table, {'target_table': 'report_rc.rpt_sp_journal_dashboard'}),
+
         (create_journal_base, {'journal_base': False, 'start_date': '2024-01-01', 'db_method': 'replace', 'transform' : False}), # 1. Create Journal Order
 
         (create_journal_base, {'journal_base': False, 'start_date': '2024-01-01', 'db_method': 'replace', 'transform' : True}), # 2. Create Journal Order Transform
@@ -951,13 +1002,18 @@ if __name__ == '__main__':
     months = get_month_list(month_start='202412',month_end='202412',month_format='%Y%m')
 
     # 3. Create Journal Base (looped)
-    for folder in rc_shopee_store_info.keys():
-        for month in months:
-            tasks.append((create_journal_base, {'journal_base': True, 'data_month': month, 'folder_id': folder, 'db_method': 'append', 'transform' : False}))
+    # The journal base of every store is buffered and written once per month,
+    # the journal base of the next month reads the previous months, so the buffer is flushed before it
+    for month in months:
+        for folder in rc_shopee_store_info.keys():
+            tasks.append((create_journal_base, {'journal_base': True, 'data_month': month, 'folder_id': folder, 'db_method': 'append', 'transform' : False, 'buffered': True}))
+        tasks.append((flush_write_buffer, {}))
 
     # 4. Create Journal Dashboard (looped)
+    # Nothing in this run reads the report and dashboard tables, they are written once at the end
     for folder in rc_shopee_store_info.keys():
         for month in months:
-            tasks.append((create_journal_dashboard, {'report_month': month, 'folder_id': folder, 'db_method': 'append'}))
+            tasks.append((create_journal_dashboard, {'report_month': month, 'folder_id': folder, 'db_method': 'append', 'buffered': True}))
+    tasks.append((flush_write_buffer, {}))
 
     log_function(tasks)
\ No newline at end of file
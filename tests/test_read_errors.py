@@ -0,0 +1,56 @@
+import os
+import sys
+import tempfile
+
+import pytest
+
+PROJECT_PATH = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, PROJECT_PATH)
+os.environ.setdefault("PROJECT_PATH", PROJECT_PATH)
+os.environ["BI_CACHE_PATH"] = tempfile.mkdtemp() # the header row cache of the test files stays out of the real cache
+
+from bi_function import read_files_parallel, read_files_in_batches, raise_read_errors
+from data_loader import sp_income_released, sp_order_data, sp_pay_wallet
+
+STORE_DIM = {'ABC_12345': ['12345', 'ID', 'IDR', 'SHOPEE', 'ABC']}
+LOADERS = [sp_order_data, sp_income_released, sp_pay_wallet]
+
+def write_file(tmp_path, name, content):
+    folder = tmp_path / 'ABC_12345' # read_table takes the store from the parent folder name
+    folder.mkdir(exist_ok=True)
+    path = folder / name
+    path.write_bytes(content)
+    return str(path)
+
+@pytest.mark.parametrize('loader', LOADERS, ids=lambda loader: loader.__name__)
+def test_corrupt_xlsx_is_a_read_error(tmp_path, loader):
+    path = write_file(tmp_path, 'corrupt.xlsx', b'PK\x03\x04 not a workbook')
+
+    df_list, read_errors = read_files_parallel(loader.read_table, [path], store_dim=STORE_DIM)
+
+    assert list(read_errors) == [path]
+    assert len(df_list[0].columns) == 0
+    with pytest.raises(RuntimeError, match='1 files failed to read'):
+        raise_read_errors(read_errors, 'test.' + loader.__name__)
+
+def test_missing_required_column_is_a_read_error(tmp_path):
+    path = write_file(tmp_path, 'other_export.csv', b'foo,bar\n1,2\n')
+
+    df_list, read_errors = read_files_parallel(sp_order_data.read_table, [path], store_dim=STORE_DIM)
+
+    assert 'Column schema has changed' in read_errors[path]
+
+def test_batched_read_collects_the_errors(tmp_path):
+    path = write_file(tmp_path, 'corrupt.xlsx', b'not a workbook')
+    parsed_columns, read_errors = [], {}
+
+    batches = list(read_files_in_batches(sp_pay_wallet.read_table, [path], 1000, parsed_columns,
+                                         read_errors=read_errors, store_dim=STORE_DIM))
+
+    assert batches == []
+    assert list(read_errors) == [path]
+    with pytest.raises(RuntimeError):
+        raise_read_errors(read_errors, 'test.sp_pay_wallet')
+
+def test_no_read_error_does_not_raise():
+    raise_read_errors({}, 'test.sp_pay_wallet')